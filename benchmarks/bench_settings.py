@@ -0,0 +1,260 @@
+#
+# bench_settings.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Benchmarks for settings conversion and apply against fake sessions.
+
+Usage:
+  python benchmarks/bench_settings.py [--iterations N] [--save-baseline]
+    [--baseline FILE] [--threshold FRACTION] [--api dict|attr]
+
+Requires Deluge and Twisted to be importable. Work that normally runs in
+a thread is run inline, and set_preferences_reactor reports the part of
+each apply that blocks the reactor. Allocations are measured as the
+number of container objects left per call (before and after a cyclic
+collection) and the growth of the peak RSS. Results are compared with
+the stored baseline and the script exits with status 1 if any benchmark
+is slower, or leaves more objects per call, than the baseline by more
+than the threshold.
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import optparse
+import resource
+
+import fake_session
+
+from twisted.internet import defer
+
+import deluge.component
+import deluge.configmanager
+
+import ltconfig.core
+import ltconfig.common.schema
+
+from ltconfig.common.presets import (
+  HIGH_PERFORMANCE_SEED, MIN_MEMORY_USAGE,
+)
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def flush_apply(core):
+
+  call = core._apply_call
+  if call and call.active():
+    call.cancel()
+    core._flush_apply()
+
+
+def create_core(api):
+
+  session = fake_session.SESSION_TYPES[api]()
+
+  components = fake_session.FakeComponents(session)
+  deluge.component.get = components.get
+
+  ltconfig.core.libtorrent = fake_session.FakeLibtorrent(session.version)
+  # Run threaded work inline so each call completes synchronously
+  ltconfig.core.deferToThread = defer.maybeDeferred
+  ltconfig.common.schema._SCHEMA_CACHE.clear()
+
+  core = ltconfig.core.Core(ltconfig.core.PLUGIN_NAME)
+  core.enable()
+
+  return core
+
+
+def get_max_rss():
+
+  # Kilobytes on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(func, iterations):
+
+  gc.collect()
+  objects = len(gc.get_objects())
+  max_rss = get_max_rss()
+
+  # Cyclic garbage stays countable until the collection below
+  gc.disable()
+  try:
+    start = time.time()
+    for i in xrange(iterations):
+      func(i)
+    elapsed = time.time() - start
+
+    allocated = len(gc.get_objects()) - objects
+  finally:
+    gc.enable()
+
+  gc.collect()
+  retained = len(gc.get_objects()) - objects
+
+  return {
+    "us_per_op": elapsed * 1000000 / iterations,
+    "objects_per_op": float(allocated) / iterations,
+    "retained_per_op": float(retained) / iterations,
+    "max_rss_kb": get_max_rss() - max_rss,
+  }
+
+
+def run_benchmarks(api, iterations):
+
+  core = create_core(api)
+
+  prefs = [
+    {"apply_on_start": False, "settings": dict(HIGH_PERFORMANCE_SEED)},
+    {"apply_on_start": False, "settings": dict(MIN_MEMORY_USAGE)},
+  ]
+
+  def bench_get_settings(i):
+    core.get_settings()
+
+  def bench_get_preset(i):
+    core.get_preset(2)
+
+  def bench_set_preferences(i):
+    p = prefs[i % 2]
+    core.set_preferences({
+      "apply_on_start": p["apply_on_start"],
+      "settings": dict(p["settings"]),
+    })
+    flush_apply(core)
+
+  def bench_normalize_settings(i):
+    core._normalize_settings(dict(HIGH_PERFORMANCE_SEED))
+
+  results = {}
+  for name, func in (
+      ("get_settings", bench_get_settings),
+      ("get_preset", bench_get_preset),
+      ("set_preferences", bench_set_preferences),
+      ("normalize_settings", bench_normalize_settings)):
+    results[name] = measure(func, iterations)
+
+  # Time spent blocking the reactor per apply queued by set_preferences
+  records = [r for r in core._metrics.records if r["kind"] == "set_preferences"]
+  if records:
+    results["set_preferences_reactor"] = {
+      "us_per_op": sum(r["reactor"] for r in records) * 1000 / len(records),
+    }
+
+  core.disable()
+
+  return results
+
+
+def compare(results, baseline, threshold):
+
+  regressions = []
+
+  for api in sorted(results):
+    for name in sorted(results[api]):
+      current = results[api][name]["us_per_op"]
+      previous = baseline.get(api, {}).get(name, {}).get("us_per_op")
+
+      if previous:
+        change = (current - previous) / previous
+        status = "REGRESSION" if change > threshold else "ok"
+        print "%-5s %-20s %10.1f us/op (%+6.1f%%) %s" % (
+          api, name, current, change * 100, status)
+        if change > threshold:
+          regressions.append((api, name))
+      else:
+        print "%-5s %-20s %10.1f us/op" % (api, name, current)
+
+      objects = results[api][name].get("objects_per_op")
+      if objects is None:
+        continue
+
+      # Allow one object of noise per call on top of the threshold
+      previous = baseline.get(api, {}).get(name, {}).get("objects_per_op")
+      if previous is not None and objects > previous * (1 + threshold) + 1:
+        print "%-5s %-20s %10.1f objects/op (was %.1f) REGRESSION" % (
+          api, name, objects, previous)
+        regressions.append((api, name))
+      else:
+        print "%-5s %-20s %10.1f objects/op, %.1f retained, +%d KiB RSS" % (
+          api, name, objects, results[api][name]["retained_per_op"],
+          results[api][name]["max_rss_kb"])
+
+  return regressions
+
+
+def main():
+
+  parser = optparse.OptionParser()
+  parser.add_option("--iterations", type="int", default=200)
+  parser.add_option("--api", action="append", choices=["dict", "attr"])
+  parser.add_option("--baseline", default=BASELINE_FILE)
+  parser.add_option("--threshold", type="float", default=0.25)
+  parser.add_option("--save-baseline", action="store_true", default=False)
+  options, args = parser.parse_args()
+
+  config_dir = tempfile.mkdtemp()
+  deluge.configmanager.set_config_dir(config_dir)
+
+  try:
+    results = {}
+    for api in options.api or sorted(fake_session.SESSION_TYPES):
+      results[api] = run_benchmarks(api, options.iterations)
+  finally:
+    shutil.rmtree(config_dir, ignore_errors=True)
+
+  baseline = {}
+  if os.path.isfile(options.baseline):
+    with open(options.baseline) as f:
+      baseline = json.load(f)
+
+  regressions = compare(results, baseline, options.threshold)
+
+  if options.save_baseline:
+    with open(options.baseline, "w") as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+    print "Baseline saved to %s" % options.baseline
+  elif regressions:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,289 @@
+#
+# fake_session.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""In-process fake libtorrent sessions for benchmarking."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ltconfig.common.presets import LIBTORRENT_DEFAULTS
+
+
+# Settings that are floats in the attribute API (< 1.1.x).
+FLOAT_SETTINGS = [
+  "peer_turnover",
+  "peer_turnover_cutoff",
+  "seed_time_ratio_limit",
+  "share_ratio_limit",
+]
+
+# Settings that are libtorrent enums in the attribute API.
+ENUM_SETTINGS = [
+  "choking_algorithm",
+  "disk_cache_algorithm",
+  "mixed_mode_algorithm",
+  "seed_choking_algorithm",
+  "suggest_mode",
+]
+
+DHT_DEFAULTS = {
+  "aggressive_lookups": True,
+  "enforce_node_id": False,
+  "extended_routing_table": True,
+  "ignore_dark_internet": True,
+  "max_dht_items": 700,
+  "max_fail_count": 20,
+  "max_peers_reply": 100,
+  "max_torrent_search_reply": 20,
+  "max_torrents": 2000,
+  "privacy_lookups": False,
+  "restrict_routing_ips": True,
+  "restrict_search_ips": True,
+  "search_branching": 5,
+}
+
+
+class FakeEnum(int):
+  pass
+
+FakeEnum.__module__ = "libtorrent"
+
+
+class FakeLibtorrent(object):
+
+  def __init__(self, version):
+
+    self.version = version
+
+    parts = version.split(".")
+    self.version_major = int(parts[0])
+    self.version_minor = int(parts[1])
+
+
+class SettingsObject(object):
+
+  def __init__(self, values):
+
+    for k, v in values.iteritems():
+      setattr(self, k, v)
+
+
+  def copy(self):
+
+    return SettingsObject(dict((k, v) for k, v in self.__dict__.iteritems()))
+
+
+class BaseSession(object):
+
+  def __init__(self):
+
+    self.service_restarts = 0
+    self.applies = 0
+    self._dht_settings = SettingsObject(DHT_DEFAULTS)
+
+    # Synthetic values returned by status()
+    self.stats = {
+      "upload_rate": 0,
+      "download_rate": 0,
+      "payload_upload_rate": 0,
+      "payload_download_rate": 0,
+      "num_peers": 0,
+    }
+
+
+  def status(self):
+
+    return SettingsObject(self.stats)
+
+
+  def get_dht_settings(self):
+
+    return self._dht_settings.copy()
+
+
+  def set_dht_settings(self, settings_obj):
+
+    self._dht_settings = settings_obj.copy()
+
+
+  def _restart(self):
+
+    self.service_restarts += 1
+
+  start_dht = stop_dht = _restart
+  start_lsd = stop_lsd = _restart
+  start_natpmp = stop_natpmp = _restart
+  start_upnp = stop_upnp = _restart
+
+
+class DictSession(BaseSession):
+  """Session using the dict settings API (libtorrent >= 1.1.x)."""
+
+  version = "1.1.5.0"
+
+
+  def __init__(self):
+
+    super(DictSession, self).__init__()
+    self._settings = dict(LIBTORRENT_DEFAULTS)
+
+
+  def get_settings(self):
+
+    return dict(self._settings)
+
+
+  def apply_settings(self, settings):
+
+    self.applies += 1
+    for k, v in settings.iteritems():
+      if k in self._settings:
+        self._settings[k] = v
+
+
+class AttrSession(BaseSession):
+  """Session using the session_settings object API (libtorrent < 1.1.x)."""
+
+  version = "1.0.11.0"
+
+
+  def __init__(self):
+
+    super(AttrSession, self).__init__()
+
+    values = {}
+    for k, v in LIBTORRENT_DEFAULTS.iteritems():
+      if k in FLOAT_SETTINGS:
+        v = v / 100.0
+      elif k in ENUM_SETTINGS:
+        v = FakeEnum(v)
+      values[k] = v
+
+    self._settings = SettingsObject(values)
+
+
+  def settings(self):
+
+    return self._settings.copy()
+
+
+  def set_settings(self, settings_obj):
+
+    self.applies += 1
+    self._settings = settings_obj.copy()
+
+
+SESSION_TYPES = {
+  "dict": DictSession,
+  "attr": AttrSession,
+}
+
+
+class FakeRPCFactory(object):
+
+  def __init__(self):
+
+    self.methods = {}
+
+
+class FakeRPCServer(object):
+
+  def __init__(self):
+
+    self.factory = FakeRPCFactory()
+
+
+  def register_object(self, obj, name=None):
+
+    pass
+
+
+class FakeCore(object):
+
+  def __init__(self, session):
+
+    self.session = session
+
+
+class FakePreferencesManager(object):
+
+  def __init__(self):
+
+    self.config = {
+      "download_location": os.path.expanduser("~"),
+      "dht": True,
+      "lsd": True,
+      "natpmp": True,
+      "upnp": True,
+    }
+
+
+class FakeEventManager(object):
+
+  def __init__(self):
+
+    self.events = []
+
+
+  def emit(self, event):
+
+    self.events.append(event)
+
+
+class FakeTorrentManager(object):
+
+  def __init__(self):
+
+    self.torrents = {}
+
+
+class FakeComponents(object):
+
+  def __init__(self, session):
+
+    self.components = {
+      "Core": FakeCore(session),
+      "RPCServer": FakeRPCServer(),
+      "PreferencesManager": FakePreferencesManager(),
+      "EventManager": FakeEventManager(),
+      "TorrentManager": FakeTorrentManager(),
+    }
+
+
+  def get(self, name):
+
+    return self.components[name]
@@ -76,3 +76,38 @@ def init_config(config, defaults, version, specs):
       del config.config[key]
 
   return file_ver
+
+
+class ConfigWriter(object):
+
+  def __init__(self, config, delay):
+
+    self._config = config
+    self._delay = delay
+    self._call = None
+    self._saved = None
+
+
+  def schedule(self):
+
+    import twisted.internet.reactor
+
+    if not self._call or not self._call.active():
+      self._call = twisted.internet.reactor.callLater(self._delay, self.flush)
+
+
+  def flush(self):
+
+    if self._call and self._call.active():
+      self._call.cancel()
+
+    self._call = None
+
+    if self._config.config == self._saved:
+      return False
+
+    # Config.save() writes to a temporary file and renames it into place
+    self._config.save()
+    self._saved = copy.deepcopy(self._config.config)
+
+    return True
@@ -39,7 +39,35 @@ CONFIG_DEFAULTS_V1 = {
   "settings": {},
   }
 
-CONFIG_VERSION = 1
-CONFIG_DEFAULTS = CONFIG_DEFAULTS_V1
+CONFIG_DEFAULTS_V2 = {
+  "apply_on_start": False,
+  "apply_delay": 0.5,
+  "save_delay": 5.0,
+  "history_size": 50,
+  "history": {},
+  "stats_interval": 1.0,
+  "controllers": {},
+  "schedule": {},
+  "overrides": [],
+  "rules": {},
+  "memory_budget": 0,
+  "early_apply": True,
+  "startup_history": [],
+  "settings": {},
+  }
+
+CONFIG_VERSION = 2
+CONFIG_DEFAULTS = CONFIG_DEFAULTS_V2
 
-CONFIG_SPECS = {}
+CONFIG_SPECS = {
+  (1, 2): {
+    "version_in": 1,
+    "version_out": 2,
+    "defaults": CONFIG_DEFAULTS_V2,
+    "strict": False,
+    "deepcopy": False,
+    "map": {
+      "*": "*",
+    },
+  },
+}
@@ -0,0 +1,355 @@
+#
+# controllers.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Feedback controllers that adjust settings from sampled session stats."""
+
+import time
+import collections
+
+from hardware import get_total_memory
+
+
+# Number of adjustments kept per controller.
+ADJUSTMENT_HISTORY_SIZE = 50
+
+# Size of a disk cache block in bytes.
+CACHE_BLOCK_SIZE = 16 * 1024
+
+CACHE_TUNER_DEFAULTS = {
+  "enabled": False,
+  # Seconds between evaluations
+  "interval": 30.0,
+  # Bounds for cache_size in MiB
+  "min_cache_mb": 16,
+  "max_cache_mb": 512,
+  # Shrink regardless of hit ratio above this RSS in MiB; 0 disables
+  "max_rss_mb": 0,
+  # Grow below the low hit ratio, shrink above the high hit ratio
+  "low_hit_ratio": 0.6,
+  "high_hit_ratio": 0.95,
+  # Block reads and writes per second below which the cache is idle
+  "min_activity": 1.0,
+  # Relative change of cache_size per adjustment
+  "step": 0.25,
+  # Consecutive evaluations that must agree before adjusting
+  "patience": 3,
+}
+
+PEER_CONTROLLER_DEFAULTS = {
+  "enabled": False,
+  # Seconds between evaluations
+  "interval": 60.0,
+  # Payload upload rate to reach in KiB/s
+  "upload_goal": 10240.0,
+  # Relative band around the goal treated as on target
+  "tolerance": 0.1,
+  # Shrink regardless of upload rate above this CPU usage (1.0 is one core)
+  "cpu_ceiling": 0.8,
+  # Bounds for the controlled settings
+  "min_connections": 20,
+  "max_connections": 2000,
+  "min_unchoke_slots": 2,
+  "max_unchoke_slots": 200,
+  "min_peerlist_size": 500,
+  "max_peerlist_size": 10000,
+  # Relative change of each setting per adjustment
+  "step": 0.2,
+  # Consecutive evaluations that must agree before adjusting
+  "patience": 2,
+}
+
+
+def parse_options(defaults, options):
+
+  parsed = dict(defaults)
+  for key in defaults:
+    if key in (options or {}):
+      parsed[key] = type(defaults[key])(options[key])
+
+  return parsed
+
+
+class Controller(object):
+
+  name = None
+  defaults = {}
+  keys = []
+
+  def __init__(self, options):
+
+    self.options = parse_options(self.defaults, options)
+    self.state = "idle"
+    self.last_sample = None
+    self.last_evaluated = None
+    self.adjustments = collections.deque(maxlen=ADJUSTMENT_HISTORY_SIZE)
+
+    self._direction = 0
+    self._votes = 0
+    self._immediate = False
+
+
+  def configure(self, options):
+
+    merged = dict(self.options)
+    merged.update(options)
+    self.options = parse_options(self.defaults, merged)
+
+    self._direction = 0
+    self._votes = 0
+
+
+  @property
+  def enabled(self):
+
+    return self.options["enabled"]
+
+
+  def evaluate(self, sample, current, pinned=()):
+
+    self.last_sample = dict(sample)
+    self.last_evaluated = time.time()
+
+    if not self.enabled:
+      self.state = "disabled"
+      return {}
+
+    if all(key in pinned for key in self.keys):
+      self.state = "pinned"
+      return {}
+
+    self._immediate = False
+    direction, reason = self.decide(sample, current)
+
+    # Hysteresis: act only once the same direction repeats, unless the
+    # decision asked to skip the wait
+    if direction and self._immediate:
+      self._direction = direction
+      self._votes = self.options["patience"]
+    elif direction and direction == self._direction:
+      self._votes += 1
+    else:
+      self._direction = direction
+      self._votes = 1 if direction else 0
+
+    if not direction or self._votes < self.options["patience"]:
+      self.state = "holding" if not direction else "pending"
+      return {}
+
+    self._votes = 0
+    changes = self.adjust(direction, current)
+
+    changes = dict((k, v) for k, v in changes.iteritems()
+      if k not in pinned and current.get(k) != v)
+    if not changes:
+      self.state = "bounded"
+      return {}
+
+    self.state = "adjusted"
+    self.adjustments.append({
+      "time": self.last_evaluated,
+      "reason": reason,
+      "old": dict((k, current.get(k)) for k in changes),
+      "new": dict(changes),
+      "sample": dict(sample),
+    })
+
+    return changes
+
+
+  def decide(self, sample, current):
+
+    return 0, None
+
+
+  def adjust(self, direction, current):
+
+    return {}
+
+
+  def status(self):
+
+    return {
+      "name": self.name,
+      "state": self.state,
+      "options": dict(self.options),
+      "last_evaluated": self.last_evaluated,
+      "last_sample": self.last_sample,
+      "adjustments": list(self.adjustments),
+    }
+
+
+class CacheTuner(Controller):
+
+  name = "cache_tuner"
+  defaults = CACHE_TUNER_DEFAULTS
+  keys = ["cache_size"]
+
+  def __init__(self, options, total_memory=None):
+
+    super(CacheTuner, self).__init__(options)
+
+    # Physical memory in bytes, read when first needed if not given
+    self.total_memory = total_memory
+
+
+  def get_bounds(self):
+
+    blocks_per_mb = 1024 * 1024 / CACHE_BLOCK_SIZE
+
+    return (self.options["min_cache_mb"] * blocks_per_mb,
+      self.options["max_cache_mb"] * blocks_per_mb)
+
+
+  def decide(self, sample, current):
+
+    max_rss = self.options["max_rss_mb"] * 1024 * 1024
+    if max_rss and sample.get("rss", 0) > max_rss:
+      # Memory pressure skips the hysteresis wait
+      self._immediate = True
+      return -1, "rss above limit"
+
+    hits = sample.get("cache_hits") or 0.0
+    reads = sample.get("blocks_read") or 0.0
+    writes = sample.get("blocks_written") or 0.0
+
+    if hits + reads + writes < self.options["min_activity"]:
+      return -1, "idle"
+
+    if hits + reads:
+      ratio = hits / (hits + reads)
+      if ratio < self.options["low_hit_ratio"]:
+        return 1, "hit ratio %.2f" % ratio
+      if ratio > self.options["high_hit_ratio"]:
+        return -1, "hit ratio %.2f" % ratio
+
+    return 0, None
+
+
+  def adjust(self, direction, current):
+
+    low, high = self.get_bounds()
+
+    size = current.get("cache_size")
+    if size is not None and size < 0:
+      size = self.get_automatic_size()
+      if size is None:
+        return {}
+
+    if size is None or size < low:
+      size = low
+
+    new_size = int(size * (1 + direction * self.options["step"]))
+    new_size = max(low, min(high, new_size))
+
+    # The bounds must not turn the adjustment around
+    if (new_size - size) * direction < 0:
+      return {}
+
+    return {"cache_size": new_size}
+
+
+  def get_automatic_size(self):
+
+    if self.total_memory is None:
+      self.total_memory = get_total_memory()
+
+    if not self.total_memory:
+      return None
+
+    # libtorrent sizes an automatic cache to an eighth of physical memory
+    return self.total_memory / 8 / CACHE_BLOCK_SIZE
+
+
+class PeerController(Controller):
+
+  name = "peer_controller"
+  defaults = PEER_CONTROLLER_DEFAULTS
+  keys = ["connections_limit", "unchoke_slots_limit", "max_peerlist_size"]
+
+  # Option names holding the bounds of each setting
+  bounds = {
+    "connections_limit": ("min_connections", "max_connections"),
+    "unchoke_slots_limit": ("min_unchoke_slots", "max_unchoke_slots"),
+    "max_peerlist_size": ("min_peerlist_size", "max_peerlist_size"),
+  }
+
+  def decide(self, sample, current):
+
+    cpu = sample.get("cpu")
+    if cpu is not None and cpu > self.options["cpu_ceiling"]:
+      return -1, "cpu %.2f" % cpu
+
+    rate = sample.get("payload_upload_rate")
+    if rate is None:
+      return 0, None
+
+    goal = self.options["upload_goal"] * 1024
+    tolerance = self.options["tolerance"]
+
+    if rate < goal * (1 - tolerance):
+      if cpu is not None and cpu > self.options["cpu_ceiling"] * (1 - tolerance):
+        # Growing would push the CPU over the ceiling
+        return 0, None
+      return 1, "upload rate %.0f B/s" % rate
+
+    if rate > goal * (1 + tolerance):
+      return -1, "upload rate %.0f B/s" % rate
+
+    return 0, None
+
+
+  def adjust(self, direction, current):
+
+    changes = {}
+    for key in self.keys:
+      low = self.options[self.bounds[key][0]]
+      high = self.options[self.bounds[key][1]]
+
+      # Negative values mean unlimited
+      value = current.get(key)
+      if value is None or value < 0:
+        value = high
+
+      value = int(round(value * (1 + direction * self.options["step"])))
+      changes[key] = max(low, min(high, value))
+
+    return changes
+
+
+# Controllers available to Core by name.
+CONTROLLERS = {
+  CacheTuner.name: CacheTuner,
+  PeerController.name: PeerController,
+}
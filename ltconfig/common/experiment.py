@@ -0,0 +1,250 @@
+#
+# experiment.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Interleaved A/B comparison of settings sets."""
+
+import math
+import time
+
+
+EXPERIMENT_DEFAULTS = {
+  # [{"name": name, "preset": id} or {"name": name, "settings": {...}}]
+  "arms": [],
+  # Seconds each arm runs per slot
+  "slot_duration": 1800.0,
+  # Slots per arm
+  "rounds": 4,
+  # Seconds at the start of each slot left out while settings settle
+  "warmup": 120.0,
+  # Stats compared between arms
+  "metrics": [
+    "payload_upload_rate",
+    "payload_download_rate",
+    "num_peers",
+    "cpu",
+    "rss",
+  ],
+}
+
+# Two-sided 95% critical values of Student's t by degrees of freedom.
+T_CRITICAL_95 = [
+  None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+  2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093,
+  2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045,
+  2.042,
+]
+
+
+def validate_experiment(options):
+
+  validated = dict(EXPERIMENT_DEFAULTS)
+  validated.update(options)
+
+  arms = validated["arms"]
+  if len(arms) < 2:
+    raise ValueError("Experiment needs at least two arms")
+
+  names = [arm.get("name") for arm in arms]
+  if None in names or len(set(names)) != len(names):
+    raise ValueError("Experiment arms need unique names")
+
+  for arm in arms:
+    if "preset" not in arm and "settings" not in arm:
+      raise ValueError("Arm %r needs a preset or settings" % arm["name"])
+
+  if validated["slot_duration"] <= validated["warmup"]:
+    raise ValueError("Slot duration must be longer than the warmup")
+
+  if validated["rounds"] < 1:
+    raise ValueError("Experiment needs at least one round")
+
+  return validated
+
+
+def t_critical(df):
+
+  if df < 1:
+    return None
+
+  if df < len(T_CRITICAL_95):
+    return T_CRITICAL_95[df]
+
+  return 1.96
+
+
+def summarize(values):
+
+  n = len(values)
+  if not n:
+    return {"n": 0, "mean": None, "variance": None, "ci": None}
+
+  mean = float(sum(values)) / n
+  if n < 2:
+    return {"n": n, "mean": mean, "variance": None, "ci": None}
+
+  variance = sum((v - mean) ** 2 for v in values) / (n - 1)
+  margin = t_critical(n - 1) * math.sqrt(variance / n)
+
+  return {
+    "n": n,
+    "mean": mean,
+    "variance": variance,
+    "ci": [mean - margin, mean + margin],
+  }
+
+
+def compare(a, b):
+
+  # Welch's t interval for the difference of means b - a
+  if a["variance"] is None or b["variance"] is None:
+    return None
+
+  va = a["variance"] / a["n"]
+  vb = b["variance"] / b["n"]
+  diff = b["mean"] - a["mean"]
+
+  if not va and not vb:
+    return {"difference": diff, "ci": [diff, diff]}
+
+  df = (va + vb) ** 2 / (va ** 2 / (a["n"] - 1) + vb ** 2 / (b["n"] - 1))
+  margin = t_critical(int(df)) * math.sqrt(va + vb)
+
+  return {"difference": diff, "ci": [diff - margin, diff + margin]}
+
+
+class Experiment(object):
+
+  def __init__(self, options):
+
+    self.options = validate_experiment(options)
+    self.arms = self.options["arms"]
+
+    # Reverse every other round so slow drifts affect arms evenly
+    self.order = []
+    for i in xrange(self.options["rounds"]):
+      indexes = range(len(self.arms))
+      self.order.extend(indexes if i % 2 == 0 else indexes[::-1])
+
+    self.slots = []
+    self.state = "created"
+    self.started = None
+    self.finished = None
+    self.slot_started = None
+
+
+  @property
+  def current_arm(self):
+
+    if self.state != "running":
+      return None
+
+    return self.arms[self.order[len(self.slots)]]
+
+
+  def start(self, now=None):
+
+    self.started = self.slot_started = time.time() if now is None else now
+    self.state = "running"
+
+
+  def end_slot(self, sample, now=None):
+
+    if now is None:
+      now = time.time()
+
+    self.slots.append({
+      "arm": self.current_arm["name"],
+      "start": self.slot_started,
+      "end": now,
+      "sample": dict(sample),
+    })
+
+    self.slot_started = now
+
+    if len(self.slots) == len(self.order):
+      self.stop("finished", now)
+
+
+  def stop(self, state="stopped", now=None):
+
+    self.state = state
+    self.finished = time.time() if now is None else now
+
+
+  def get_sample_window(self):
+
+    return self.slot_started + self.options["warmup"]
+
+
+  def results(self):
+
+    results = {}
+    for arm in self.arms:
+      slots = [s for s in self.slots if s["arm"] == arm["name"]]
+      results[arm["name"]] = dict((metric,
+        summarize([s["sample"][metric] for s in slots
+          if s["sample"].get(metric) is not None]))
+        for metric in self.options["metrics"])
+
+    baseline = self.arms[0]["name"]
+    comparisons = {}
+    for arm in self.arms[1:]:
+      comparisons[arm["name"]] = dict((metric,
+        compare(results[baseline][metric], results[arm["name"]][metric]))
+        for metric in self.options["metrics"])
+
+    return {
+      "baseline": baseline,
+      "arms": results,
+      "comparisons": comparisons,
+    }
+
+
+  def status(self):
+
+    current = self.current_arm
+
+    return {
+      "state": self.state,
+      "options": self.options,
+      "started": self.started,
+      "finished": self.finished,
+      "current_arm": current["name"] if current else None,
+      "slot": len(self.slots),
+      "total_slots": len(self.order),
+      "slot_started": self.slot_started,
+      "slots": list(self.slots),
+      "results": self.results(),
+    }
@@ -0,0 +1,232 @@
+#
+# guard.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Guarded apply that reverts settings when a session metric regresses."""
+
+import time
+import logging
+
+from twisted.internet import reactor, task, defer
+
+from plugin import LOG_HANDLER
+
+
+log = logging.getLogger(__name__)
+log.addHandler(LOG_HANDLER)
+
+
+GUARD_DEFAULTS = {
+  # Session metric to watch; higher values are better
+  "metric": "upload_rate",
+  # Largest allowed relative drop from the baseline mean
+  "threshold": 0.25,
+  # Seconds to sample before applying
+  "baseline": 60,
+  # Seconds to sample after applying
+  "probation": 300,
+  # Seconds between samples
+  "interval": 5,
+}
+
+
+def mean(values):
+
+  return float(sum(values)) / len(values) if values else None
+
+
+class ApplyGuard(object):
+
+  def __init__(self, options, sample_func, apply_func, revert_func,
+      clock=None):
+
+    self.options = dict(GUARD_DEFAULTS)
+    for key in GUARD_DEFAULTS:
+      if key in options:
+        self.options[key] = type(GUARD_DEFAULTS[key])(options[key])
+
+    self.state = "idle"
+    self.started = None
+    self.baseline_samples = []
+    self.probation_samples = []
+    self.result = None
+
+    # Fires with the result of the apply once it lands
+    self.applied = defer.Deferred()
+
+    self._sample_func = sample_func
+    self._apply_func = apply_func
+    self._revert_func = revert_func
+    self._clock = clock or reactor
+
+    self._loop = None
+    self._call = None
+
+
+  @property
+  def active(self):
+
+    return self.state in ("baseline", "applying", "probation")
+
+
+  def start(self):
+
+    log.debug("Guard started: %s", self.options)
+
+    self.state = "baseline"
+    self.started = time.time()
+
+    self._loop = task.LoopingCall(self._sample)
+    self._loop.clock = self._clock
+    self._loop.start(self.options["interval"], now=True)
+
+    self._call = self._clock.callLater(self.options["baseline"], self._apply)
+
+
+  def cancel(self, reason):
+
+    if not self.active:
+      return
+
+    log.debug("Guard cancelled: %s", reason)
+
+    applying = self.state in ("baseline", "applying")
+
+    self._stop()
+    self.state = "cancelled"
+    self.result = {"reason": reason}
+
+    if applying and not self.applied.called:
+      self.applied.errback(defer.CancelledError(reason))
+
+
+  def status(self):
+
+    return {
+      "state": self.state,
+      "options": dict(self.options),
+      "started": self.started,
+      "baseline": mean(self.baseline_samples),
+      "probation": mean(self.probation_samples),
+      "samples": [len(self.baseline_samples), len(self.probation_samples)],
+      "result": self.result,
+    }
+
+
+  def _stop(self):
+
+    if self._loop and self._loop.running:
+      self._loop.stop()
+
+    if self._call and self._call.active():
+      self._call.cancel()
+
+    self._loop = None
+    self._call = None
+
+
+  def _sample(self):
+
+    value = self._sample_func().get(self.options["metric"])
+    if value is None:
+      return
+
+    if self.state == "baseline":
+      self.baseline_samples.append(value)
+    elif self.state == "probation":
+      self.probation_samples.append(value)
+
+
+  def _apply(self):
+
+    self._call = None
+    self.state = "applying"
+
+    d = defer.maybeDeferred(self._apply_func)
+    d.addCallbacks(self._on_applied, self._on_apply_failed)
+
+
+  def _on_applied(self, result):
+
+    if self.state != "applying":
+      return
+
+    self.state = "probation"
+    self._call = self._clock.callLater(self.options["probation"],
+      self._evaluate)
+
+    self.applied.callback(result)
+
+
+  def _on_apply_failed(self, failure):
+
+    if self.state != "applying":
+      return
+
+    self._stop()
+    self.state = "failed"
+    self.result = {"reason": failure.getErrorMessage()}
+
+    self.applied.errback(failure)
+
+
+  def _evaluate(self):
+
+    self._call = None
+    self._stop()
+
+    baseline = mean(self.baseline_samples)
+    current = mean(self.probation_samples)
+
+    regression = 0.0
+    if baseline and current is not None:
+      regression = (baseline - current) / baseline
+
+    self.result = {
+      "metric": self.options["metric"],
+      "baseline": baseline,
+      "probation": current,
+      "regression": regression,
+    }
+
+    if regression > self.options["threshold"]:
+      log.warning("Guard reverting settings: %s dropped %.1f%% "
+        "(%.1f -> %.1f)", self.options["metric"], regression * 100,
+        baseline, current)
+      self.state = "reverted"
+      self._revert_func()
+    else:
+      log.info("Guard accepted settings: %s changed %+.1f%%",
+        self.options["metric"], -regression * 100)
+      self.state = "accepted"
@@ -0,0 +1,178 @@
+#
+# hardware.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Preset generated from the hardware deluged is running on."""
+
+import os
+import logging
+import multiprocessing
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+from plugin import LOG_HANDLER
+
+
+log = logging.getLogger(__name__)
+log.addHandler(LOG_HANDLER)
+
+
+KIB = 1024
+MIB = 1024 * KIB
+GIB = 1024 * MIB
+
+# Size of a disk cache block in bytes.
+CACHE_BLOCK_SIZE = 16 * KIB
+
+# Fallbacks for facts that cannot be read.
+DEFAULT_MEMORY = 1 * GIB
+DEFAULT_NOFILE = 1024
+
+
+def clamp(value, lower, upper):
+
+  return max(lower, min(upper, value))
+
+
+def get_total_memory(path="/proc/meminfo"):
+
+  try:
+    with open(path) as f:
+      for line in f:
+        if line.startswith("MemTotal:"):
+          return int(line.split()[1]) * KIB
+  except (IOError, ValueError, IndexError):
+    pass
+
+  return None
+
+
+def get_cpu_count():
+
+  try:
+    return multiprocessing.cpu_count()
+  except NotImplementedError:
+    return None
+
+
+def get_nofile_limit():
+
+  if resource is None:
+    return None
+
+  try:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+  except (ValueError, resource.error):
+    return None
+
+  if soft == resource.RLIM_INFINITY:
+    return hard if hard != resource.RLIM_INFINITY else None
+
+  return soft
+
+
+def is_rotational(path):
+
+  try:
+    dev = os.stat(path).st_dev
+  except OSError:
+    return None
+
+  block = os.path.realpath("/sys/dev/block/%d:%d" %
+    (os.major(dev), os.minor(dev)))
+
+  # Partitions keep the queue attributes on the parent device
+  for device in (block, os.path.dirname(block)):
+    try:
+      with open(os.path.join(device, "queue", "rotational")) as f:
+        return f.read().strip() == "1"
+    except IOError:
+      continue
+
+  return None
+
+
+def get_hardware_facts(download_location):
+
+  facts = {
+    "memory": get_total_memory(),
+    "cpu_count": get_cpu_count(),
+    "nofile": get_nofile_limit(),
+    "rotational": is_rotational(download_location),
+  }
+
+  log.debug("Hardware facts: %s", facts)
+
+  return facts
+
+
+def get_hardware_preset(facts):
+
+  memory = facts.get("memory") or DEFAULT_MEMORY
+  cpu_count = facts.get("cpu_count") or 1
+  nofile = facts.get("nofile") or DEFAULT_NOFILE
+  rotational = facts.get("rotational")
+
+  settings = {}
+
+  # Disk cache gets an eighth of the memory
+  settings["cache_size"] = clamp(memory / 8 / CACHE_BLOCK_SIZE, 64, 262144)
+
+  # Spinning disks do not benefit from many concurrent requests
+  if rotational or rotational is None:
+    settings["aio_threads"] = clamp(cpu_count, 1, 4)
+  else:
+    settings["aio_threads"] = clamp(cpu_count * 2, 4, 16)
+
+  # Keep file descriptors for files, connections and everything else
+  file_pool_size = clamp(nofile / 5, 4, 500)
+  settings["file_pool_size"] = file_pool_size
+
+  connections_limit = clamp(memory / (2 * MIB),
+    50, nofile - file_pool_size - 100)
+  settings["connections_limit"] = clamp(connections_limit, 50, 8000)
+  settings["unchoke_slots_limit"] = clamp(settings["connections_limit"] / 4,
+    8, 2000)
+
+  send_buffer_watermark = clamp(memory / 2048, 500 * KIB, 3 * MIB)
+  settings["send_buffer_watermark"] = send_buffer_watermark
+  settings["send_buffer_low_watermark"] = send_buffer_watermark / 3
+  settings["send_buffer_watermark_factor"] = 150 if memory >= 4 * GIB else 50
+
+  settings["max_queued_disk_bytes"] = clamp(memory / 512, 1 * MIB, 7 * MIB)
+
+  return settings
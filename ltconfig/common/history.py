@@ -0,0 +1,137 @@
+#
+# history.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""History of applied settings stored as compact diffs."""
+
+import copy
+import time
+
+
+class SnapshotStore(object):
+
+  def __init__(self, max_size, data=None):
+
+    self._max_size = max(1, max_size)
+
+    # Updated in place so a dict kept in the config never needs copying
+    self._data = data if data is not None else {}
+    self._data.setdefault("base", {})
+    self._data.setdefault("snapshots", [])
+    self._data.setdefault("next_id", 1)
+
+    self._base = self._data["base"]
+    self._snapshots = self._data["snapshots"]
+
+    self._current = self._rebuild(len(self._snapshots))
+    self._compact()
+
+
+  def _rebuild(self, count):
+
+    settings = dict(self._base)
+
+    for snapshot in self._snapshots[:count]:
+      settings.update(snapshot["set"])
+      for key in snapshot["unset"]:
+        settings.pop(key, None)
+
+    return settings
+
+
+  def _compact(self):
+
+    # Fold the oldest diffs into the base
+    while len(self._snapshots) > self._max_size:
+      snapshot = self._snapshots.pop(0)
+      self._base.update(snapshot["set"])
+      for key in snapshot["unset"]:
+        self._base.pop(key, None)
+
+
+  def record(self, settings, label=""):
+
+    changed = {}
+    for key, value in settings.iteritems():
+      if key not in self._current or self._current[key] != value:
+        changed[key] = value
+
+    removed = [key for key in self._current if key not in settings]
+
+    if self._snapshots and not changed and not removed:
+      return None
+
+    snapshot = {
+      "id": self._data["next_id"],
+      "time": time.time(),
+      "label": label,
+      "set": changed,
+      "unset": removed,
+    }
+
+    self._data["next_id"] += 1
+    self._snapshots.append(snapshot)
+    self._current = dict(settings)
+    self._compact()
+
+    return snapshot["id"]
+
+
+  def get(self, snapshot_id):
+
+    for i, snapshot in enumerate(self._snapshots):
+      if snapshot["id"] == snapshot_id:
+        return self._rebuild(i+1)
+
+    return None
+
+
+  def list(self):
+
+    return [{
+      "id": snapshot["id"],
+      "time": snapshot["time"],
+      "label": snapshot["label"],
+      "set": dict(snapshot["set"]),
+      "unset": list(snapshot["unset"]),
+    } for snapshot in self._snapshots]
+
+
+  def export(self):
+
+    return copy.deepcopy({
+      "base": self._base,
+      "snapshots": self._snapshots,
+      "next_id": self._data["next_id"],
+    })
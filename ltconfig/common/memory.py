@@ -0,0 +1,156 @@
+#
+# memory.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Memory footprint estimate for a libtorrent settings set."""
+
+from presets import LIBTORRENT_DEFAULTS
+
+
+KIB = 1024
+MIB = 1024 * KIB
+
+# Size of a disk cache block.
+BLOCK_SIZE = 16 * KIB
+
+# Rough fixed costs, measured on 1.0.x/1.1.x sessions.
+SESSION_OVERHEAD = 16 * MIB
+TORRENT_OVERHEAD = 32 * KIB
+PEER_OVERHEAD = 24 * KIB
+PEER_ENTRY_SIZE = 64
+
+
+
+def get_setting(settings, key):
+
+  value = settings.get(key)
+  if value is None:
+    value = LIBTORRENT_DEFAULTS.get(key, 0)
+
+  return value
+
+
+def get_peer_count(settings, num_peers):
+
+  # Peers the settings allow given the current peer count
+  limit = get_setting(settings, "connections_limit")
+
+  return num_peers if limit < 0 else min(num_peers, limit)
+
+
+def get_unchoked_count(settings, peers):
+
+  # Only unchoked peers fill their send buffers
+  slots = get_setting(settings, "unchoke_slots_limit")
+
+  return peers if slots < 0 else min(peers, slots)
+
+
+def estimate_memory(settings, num_torrents, num_peers, total_memory=None):
+
+  peers = get_peer_count(settings, num_peers)
+
+  cache_size = get_setting(settings, "cache_size")
+  if cache_size < 0:
+    # libtorrent sizes the cache to an eighth of physical memory
+    cache = (total_memory or 0) / 8
+  else:
+    cache = cache_size * BLOCK_SIZE
+
+  components = {
+    "session": SESSION_OVERHEAD,
+    "torrents": num_torrents * TORRENT_OVERHEAD,
+    "peers": peers * PEER_OVERHEAD,
+    "disk_cache": cache,
+    "send_buffers": get_unchoked_count(settings, peers) *
+      get_setting(settings, "send_buffer_watermark"),
+    "disk_queue": peers * get_setting(settings, "max_queued_disk_bytes"),
+    "peer_lists": num_torrents * PEER_ENTRY_SIZE *
+      max(0, get_setting(settings, "max_peerlist_size")),
+    "checking": get_setting(settings, "checking_mem_usage") * BLOCK_SIZE,
+  }
+
+  return {
+    "components": components,
+    "total": sum(components.itervalues()),
+    "torrents": num_torrents,
+    "peers": peers,
+  }
+
+
+# Ranges searched by the budget solver; larger values favor throughput.
+BUDGET_RANGES = {
+  "cache_size": (64, 262144),
+  "checking_mem_usage": (16, 1024),
+  "connections_limit": (50, 8000),
+  "max_peerlist_size": (200, 4000),
+  "max_queued_disk_bytes": (64 * KIB, 7 * MIB),
+  "send_buffer_watermark": (16 * KIB, 3 * MIB),
+}
+
+# Bisection steps taken by the budget solver.
+BUDGET_SOLVER_STEPS = 20
+
+
+def scale_budget_settings(level):
+
+  # Interpolate geometrically so each key moves through its range evenly
+  return dict((key, int(low * (float(high) / low) ** level))
+    for key, (low, high) in BUDGET_RANGES.iteritems())
+
+
+def solve_memory_budget(budget, settings, num_torrents, total_memory=None):
+
+  def estimate(level):
+    proposed = dict(settings)
+    proposed.update(scale_budget_settings(level))
+    # Assume every allowed connection is in use
+    return estimate_memory(proposed, num_torrents,
+      proposed["connections_limit"], total_memory)["total"]
+
+  if estimate(0.0) > budget:
+    return scale_budget_settings(0.0)
+
+  low, high = 0.0, 1.0
+  if estimate(high) <= budget:
+    low = high
+  else:
+    for i in xrange(BUDGET_SOLVER_STEPS):
+      middle = (low + high) / 2
+      if estimate(middle) <= budget:
+        low = middle
+      else:
+        high = middle
+
+  return scale_budget_settings(low)
@@ -0,0 +1,152 @@
+#
+# metrics.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Timing metrics for settings applies."""
+
+import time
+import collections
+import contextlib
+
+
+# Upper bounds in milliseconds of the duration histogram buckets.
+HISTOGRAM_BUCKETS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+
+# Stages with this prefix run off the reactor thread.
+THREAD_STAGE_PREFIX = "thread."
+
+
+class StageStats(object):
+
+  def __init__(self):
+
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+    self.buckets = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+
+  def add(self, duration):
+
+    self.count += 1
+    self.total += duration
+    self.max = max(self.max, duration)
+
+    for i, bound in enumerate(HISTOGRAM_BUCKETS):
+      if duration <= bound:
+        self.buckets[i] += 1
+        break
+    else:
+      self.buckets[-1] += 1
+
+
+  def export(self):
+
+    return {
+      "count": self.count,
+      "total": self.total,
+      "mean": self.total / self.count if self.count else 0.0,
+      "max": self.max,
+      "buckets": list(self.buckets),
+    }
+
+
+class ApplyMetrics(object):
+
+  def __init__(self, history_size=50):
+
+    self.stages = {}
+    self.records = collections.deque(maxlen=history_size)
+
+
+  def begin(self, kind):
+
+    return {
+      "kind": kind,
+      "time": time.time(),
+      "duration": 0.0,
+      "reactor": 0.0,
+      "stages": {},
+      "keys": [],
+    }
+
+
+  def end(self, record, keys=()):
+
+    record["duration"] = (time.time() - record["time"]) * 1000
+    record["keys"] = sorted(keys)
+
+    for name, duration in record["stages"].iteritems():
+      self._add(name, duration)
+
+      if not name.startswith(THREAD_STAGE_PREFIX):
+        record["reactor"] += duration
+
+    self.records.append(record)
+
+    return record
+
+
+  @contextlib.contextmanager
+  def stage(self, name, record=None):
+
+    start = time.time()
+
+    try:
+      yield
+    finally:
+      duration = (time.time() - start) * 1000
+
+      if record is not None:
+        stages = record["stages"]
+        stages[name] = stages.get(name, 0.0) + duration
+      else:
+        self._add(name, duration)
+
+
+  def _add(self, name, duration):
+
+    if name not in self.stages:
+      self.stages[name] = StageStats()
+
+    self.stages[name].add(duration)
+
+
+  def export(self):
+
+    return {
+      "buckets": list(HISTOGRAM_BUCKETS),
+      "stages": dict((k, v.export()) for k, v in self.stages.iteritems()),
+      "records": list(self.records),
+    }
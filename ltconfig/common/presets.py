@@ -35,6 +35,13 @@
 
 """Presets for libtorrent."""
 
+# Presets generated at runtime; 0 is the initial session settings.
+PRESET_HARDWARE = 4
+PRESET_MEMORY_BUDGET = 5
+
+# Ids that schedule profiles and rules may refer to.
+PRESET_IDS = range(6)
+
 LIBTORRENT_DEFAULTS = {
   "active_checking": 1,
   "active_dht_limit": 88,
@@ -0,0 +1,220 @@
+#
+# rules.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Rules that turn settings overlays on and off from sampled metrics."""
+
+import time
+import operator
+import collections
+
+from presets import PRESET_IDS
+
+
+# Number of firings kept by the engine.
+FIRING_HISTORY_SIZE = 100
+
+RULES_DEFAULTS = {
+  "enabled": False,
+  # Seconds between evaluations
+  "interval": 30.0,
+  "rules": [],
+}
+
+RULE_DEFAULTS = {
+  "name": "",
+  # [{"metric": name, "op": ">", "value": x, "clear": y}]; all must hold
+  # to activate, any one falling back past "clear" deactivates
+  "conditions": [],
+  # Overlay applied while active: {"settings": {...}} or a preset id
+  # with optional fnmatch "keys" to take from it
+  "settings": None,
+  "preset": None,
+  "keys": None,
+  # Seconds the conditions must hold before activating
+  "duration": 0.0,
+  # Seconds after a change before the rule may change again
+  "cooldown": 300.0,
+}
+
+OPERATORS = {
+  ">": operator.gt,
+  ">=": operator.ge,
+  "<": operator.lt,
+  "<=": operator.le,
+}
+
+
+def validate_rules(rules):
+
+  validated = dict(RULES_DEFAULTS)
+  validated.update(rules)
+  validated["rules"] = [validate_rule(r) for r in validated["rules"]]
+
+  names = [r["name"] for r in validated["rules"]]
+  if len(set(names)) != len(names):
+    raise ValueError("Rule names must be unique")
+
+  return validated
+
+
+def validate_rule(rule):
+
+  validated = dict(RULE_DEFAULTS)
+  validated.update(rule)
+
+  if not validated["name"]:
+    raise ValueError("Rule needs a name")
+
+  if not validated["conditions"]:
+    raise ValueError("Rule %r needs conditions" % validated["name"])
+
+  for condition in validated["conditions"]:
+    if condition.get("op") not in OPERATORS:
+      raise ValueError("Invalid operator in rule %r: %r" %
+        (validated["name"], condition.get("op")))
+    if "metric" not in condition or "value" not in condition:
+      raise ValueError("Rule %r needs a metric and value" % validated["name"])
+
+  if validated["settings"] is None and validated["preset"] is None:
+    raise ValueError("Rule %r needs settings or a preset" % validated["name"])
+
+  if validated["preset"] is not None and validated["preset"] not in PRESET_IDS:
+    raise ValueError("Unknown preset in rule %r: %r" %
+      (validated["name"], validated["preset"]))
+
+  return validated
+
+
+def check_condition(condition, sample, active):
+
+  value = sample.get(condition["metric"])
+  if value is None:
+    return None
+
+  op = OPERATORS[condition["op"]]
+
+  # Active rules hold until the metric passes back over the clear value
+  if active:
+    return op(value, condition.get("clear", condition["value"]))
+
+  return op(value, condition["value"])
+
+
+class RulesEngine(object):
+
+  def __init__(self, rules):
+
+    self.rules = rules
+    self.firings = collections.deque(maxlen=FIRING_HISTORY_SIZE)
+    self.evaluations = 0
+    self.last_evaluated = None
+    self.last_sample = None
+
+    self._states = {}
+    for rule in rules:
+      self._states[rule["name"]] = {
+        "active": False,
+        "holding_since": None,
+        "changed": None,
+        "conditions": [],
+      }
+
+
+  def get_active(self):
+
+    return [r for r in self.rules if self._states[r["name"]]["active"]]
+
+
+  def evaluate(self, sample, now=None):
+
+    if now is None:
+      now = time.time()
+
+    self.evaluations += 1
+    self.last_evaluated = now
+    self.last_sample = dict(sample)
+
+    changed = False
+    for rule in self.rules:
+      state = self._states[rule["name"]]
+
+      results = [check_condition(c, sample, state["active"])
+        for c in rule["conditions"]]
+      state["conditions"] = results
+
+      if None in results:
+        # Missing metrics leave the rule as it is
+        continue
+
+      holds = all(results)
+      if holds == state["active"]:
+        state["holding_since"] = None
+        continue
+
+      if state["holding_since"] is None:
+        state["holding_since"] = now
+
+      if now - state["holding_since"] < rule["duration"]:
+        continue
+
+      if (state["changed"] is not None and
+          now - state["changed"] < rule["cooldown"]):
+        continue
+
+      state["active"] = holds
+      state["changed"] = now
+      state["holding_since"] = None
+      changed = True
+
+      self.firings.append({
+        "time": now,
+        "rule": rule["name"],
+        "active": holds,
+        "sample": dict((c["metric"], sample.get(c["metric"]))
+          for c in rule["conditions"]),
+      })
+
+    return changed
+
+
+  def status(self):
+
+    return {
+      "evaluations": self.evaluations,
+      "last_evaluated": self.last_evaluated,
+      "last_sample": self.last_sample,
+      "rules": dict((k, dict(v)) for k, v in self._states.iteritems()),
+      "firings": list(self.firings),
+    }
@@ -0,0 +1,156 @@
+#
+# schedule.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Weekly calendar of settings profiles."""
+
+import time
+
+from presets import PRESET_IDS
+
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+SCHEDULE_DEFAULTS = {
+  "enabled": False,
+  # Profile name -> {"preset": id} or {"settings": {...}}
+  "profiles": {},
+  # [{"days": [0-6, Monday is 0], "start": "HH:MM", "profile": name}]
+  # A slot lasts until the next slot starts; an empty profile means
+  # preferences only.
+  "slots": [],
+}
+
+
+def parse_start(start):
+
+  try:
+    hours, minutes = [int(x) for x in start.split(":")]
+  except (AttributeError, ValueError):
+    raise ValueError("Invalid slot start: %r" % (start,))
+
+  if not (0 <= hours < 24 and 0 <= minutes < 60):
+    raise ValueError("Invalid slot start: %r" % (start,))
+
+  return hours * 60 + minutes
+
+
+def validate_schedule(schedule):
+
+  validated = dict(SCHEDULE_DEFAULTS)
+  validated.update(schedule)
+  validated["profiles"] = dict(validated["profiles"])
+  validated["slots"] = list(validated["slots"])
+
+  for name, profile in validated["profiles"].iteritems():
+    if "preset" not in profile and "settings" not in profile:
+      raise ValueError("Profile %r needs a preset or settings" % name)
+    if "preset" in profile and profile["preset"] not in PRESET_IDS:
+      raise ValueError("Unknown preset in profile %r: %r" %
+        (name, profile["preset"]))
+
+  for slot in validated["slots"]:
+    parse_start(slot["start"])
+
+    for day in slot["days"]:
+      if day not in range(7):
+        raise ValueError("Invalid slot day: %r" % (day,))
+
+    if slot.get("profile") and slot["profile"] not in validated["profiles"]:
+      raise ValueError("Unknown profile: %r" % slot["profile"])
+
+  return validated
+
+
+class WeeklySchedule(object):
+
+  def __init__(self, slots):
+
+    self.slots = slots
+
+    # (minute of week, slot index), sorted by start
+    self._starts = []
+    for i, slot in enumerate(slots):
+      start = parse_start(slot["start"])
+      for day in slot["days"]:
+        self._starts.append((day * MINUTES_PER_DAY + start, i))
+
+    self._starts.sort()
+
+
+  def get_minute_of_week(self, t):
+
+    tm = time.localtime(t)
+
+    return tm.tm_wday * MINUTES_PER_DAY + tm.tm_hour * 60 + tm.tm_min
+
+
+  def get_active(self, t=None):
+
+    if not self._starts:
+      return None
+
+    minute = self.get_minute_of_week(time.time() if t is None else t)
+
+    # Before the first start of the week the last slot is still running
+    active = self._starts[-1][1]
+    for start, i in self._starts:
+      if start > minute:
+        break
+      active = i
+
+    return active
+
+
+  def get_next_transition(self, t=None):
+
+    if not self._starts:
+      return None
+
+    if t is None:
+      t = time.time()
+
+    minute = self.get_minute_of_week(t)
+
+    for start, i in self._starts:
+      if start > minute:
+        break
+    else:
+      start = self._starts[0][0] + MINUTES_PER_WEEK
+
+    # Align to the start of the current minute
+    seconds = (start - minute) * 60 - time.localtime(t).tm_sec - t % 1
+
+    return t + seconds
@@ -0,0 +1,232 @@
+#
+# schema.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Settings schema for a libtorrent session."""
+
+PACK_MAIN = "main"
+PACK_DHT = "dht"
+
+DHT_PREFIX = "dht."
+
+
+# Schemas are discovered once per libtorrent version.
+_SCHEMA_CACHE = {}
+
+
+class SettingSpec(object):
+
+  __slots__ = ("name", "key", "type", "pack", "enum_type")
+
+
+  def __init__(self, name, key, val_type, pack, enum_type=None):
+
+    self.name = name
+    self.key = key
+    self.type = val_type
+    self.pack = pack
+    self.enum_type = enum_type
+
+
+  @property
+  def enum(self):
+
+    return self.enum_type is not None
+
+
+  def coerce(self, value):
+
+    return self.type(value)
+
+
+  def to_python(self, value):
+
+    if self.enum_type is not None:
+      return int(value)
+
+    return value
+
+
+  def to_libtorrent(self, value):
+
+    if self.enum_type is not None:
+      return self.enum_type(int(value))
+
+    return self.type(value)
+
+
+  def export(self):
+
+    return {
+      "type": self.type.__name__,
+      "enum": self.enum,
+      "pack": self.pack,
+    }
+
+
+class SettingsSchema(object):
+
+  def __init__(self, version, specs, dict_api):
+
+    self.version = version
+    self.dict_api = dict_api
+
+    self.specs = {}
+    self.packs = {PACK_MAIN: [], PACK_DHT: []}
+
+    for spec in specs:
+      self.specs[spec.name] = spec
+      self.packs[spec.pack].append(spec)
+
+
+  def __contains__(self, name):
+
+    return name in self.specs
+
+
+  def get(self, name):
+
+    return self.specs.get(name)
+
+
+  def read(self, settings_obj, pack=PACK_MAIN):
+
+    settings = {}
+
+    if type(settings_obj) == dict:
+      for spec in self.packs[pack]:
+        if spec.key in settings_obj:
+          settings[spec.name] = settings_obj[spec.key]
+    else:
+      for spec in self.packs[pack]:
+        settings[spec.name] = spec.to_python(getattr(settings_obj, spec.key))
+
+    return settings
+
+
+  def write(self, settings, settings_obj, pack=PACK_MAIN):
+
+    is_dict = type(settings_obj) == dict
+
+    for name in settings:
+      spec = self.specs.get(name)
+      if not spec or spec.pack != pack:
+        continue
+
+      if is_dict:
+        settings_obj[spec.key] = settings[name]
+      else:
+        setattr(settings_obj, spec.key, spec.to_libtorrent(settings[name]))
+
+
+  def normalize(self, settings, fallback):
+
+    for name in settings.keys():
+      spec = self.specs.get(name)
+      if not spec or name not in fallback:
+        del settings[name]
+        continue
+
+      try:
+        settings[name] = spec.coerce(settings[name])
+      except (TypeError, ValueError):
+        settings[name] = fallback[name]
+
+
+  def export(self):
+
+    return dict((name, spec.export()) for name, spec in self.specs.iteritems())
+
+
+def _discover_specs(settings_obj, pack, prefix, exclusions):
+
+  specs = []
+
+  if type(settings_obj) == dict:
+    for k, v in settings_obj.iteritems():
+      name = prefix + k
+      if name not in exclusions:
+        specs.append(SettingSpec(name, k, type(v), pack))
+
+    return specs
+
+  for k in dir(settings_obj):
+    name = prefix + k
+
+    if k.startswith("_") or name in exclusions:
+      continue
+
+    try:
+      v = getattr(settings_obj, k)
+    except TypeError:
+      continue
+
+    val_type = type(v)
+    if val_type.__module__ == "libtorrent":
+      try:
+        int(v)
+      except (TypeError, ValueError):
+        continue
+
+      specs.append(SettingSpec(name, k, int, pack, val_type))
+    elif not callable(v):
+      specs.append(SettingSpec(name, k, val_type, pack))
+
+  return specs
+
+
+def build_schema(session, version, exclusions=()):
+
+  if hasattr(session, "get_settings"):
+    settings_obj = session.get_settings()
+  else:
+    settings_obj = session.settings()
+
+  specs = _discover_specs(settings_obj, PACK_MAIN, "", exclusions)
+
+  if hasattr(session, "get_dht_settings"):
+    specs.extend(_discover_specs(session.get_dht_settings(), PACK_DHT,
+      DHT_PREFIX, exclusions))
+
+  return SettingsSchema(version, specs, type(settings_obj) == dict)
+
+
+def get_schema(session, version, exclusions=()):
+
+  schema = _SCHEMA_CACHE.get(version)
+  if schema is None:
+    schema = build_schema(session, version, exclusions)
+    _SCHEMA_CACHE[version] = schema
+
+  return schema
@@ -0,0 +1,338 @@
+#
+# stats.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Session statistics sampling and ring buffer history."""
+
+import os
+import array
+
+
+# Session counters (libtorrent >= 1.1.x) stored as per-second rates.
+COUNTER_METRICS = {
+  "net.sent_bytes": "upload_rate",
+  "net.recv_bytes": "download_rate",
+  "net.sent_payload_bytes": "payload_upload_rate",
+  "net.recv_payload_bytes": "payload_download_rate",
+  "disk.num_blocks_read": "blocks_read",
+  "disk.num_blocks_written": "blocks_written",
+  "disk.num_blocks_cache_hits": "cache_hits",
+}
+
+# Session gauges (libtorrent >= 1.1.x) stored as is.
+GAUGE_METRICS = {
+  "peer.num_peers_connected": "num_peers",
+  "peer.num_peers_up_unchoked": "num_unchoked",
+  "disk.disk_blocks_in_use": "cache_blocks",
+}
+
+# Session status fields (libtorrent < 1.1.x) stored as is.
+STATUS_METRICS = {
+  "upload_rate": "upload_rate",
+  "download_rate": "download_rate",
+  "payload_upload_rate": "payload_upload_rate",
+  "payload_download_rate": "payload_download_rate",
+  "num_peers": "num_peers",
+  "num_unchoked": "num_unchoked",
+}
+
+# Cache status counters (libtorrent < 1.1.x) stored as per-second rates.
+CACHE_COUNTER_METRICS = {
+  "blocks_read": "blocks_read",
+  "blocks_written": "blocks_written",
+  "blocks_read_hit": "cache_hits",
+}
+
+# Cache status gauges (libtorrent < 1.1.x) stored as is.
+CACHE_GAUGE_METRICS = {
+  "cache_size": "cache_blocks",
+}
+
+
+class RingBuffer(object):
+
+  def __init__(self, size):
+
+    self.size = size
+    self._times = array.array("d", [0.0]) * size
+    self._values = array.array("d", [0.0]) * size
+    self._head = 0
+    self._count = 0
+
+
+  def __len__(self):
+
+    return self._count
+
+
+  def append(self, t, value):
+
+    self._times[self._head] = t
+    self._values[self._head] = value
+    self._head = (self._head + 1) % self.size
+    self._count = min(self._count + 1, self.size)
+
+
+  def items(self, start=None, end=None):
+
+    items = []
+    first = (self._head - self._count) % self.size
+
+    for i in xrange(self._count):
+      j = (first + i) % self.size
+      t = self._times[j]
+
+      if start is not None and t < start:
+        continue
+      if end is not None and t > end:
+        break
+
+      items.append((t, self._values[j]))
+
+    return items
+
+
+class MetricHistory(object):
+
+  def __init__(self, resolutions):
+
+    self.resolutions = resolutions
+    self.levels = [RingBuffer(size) for interval, size in resolutions]
+
+    # Per downsampled level: [bucket, sum, count]
+    self._pending = [[None, 0.0, 0] for i in resolutions[1:]]
+
+
+  def add(self, t, value):
+
+    self.levels[0].append(t, value)
+
+    for i, (interval, size) in enumerate(self.resolutions[1:]):
+      pending = self._pending[i]
+      bucket = int(t // interval)
+
+      if pending[0] is not None and bucket != pending[0] and pending[2]:
+        self.levels[i+1].append(pending[0] * interval, pending[1] / pending[2])
+        pending[1] = 0.0
+        pending[2] = 0
+
+      pending[0] = bucket
+      pending[1] += value
+      pending[2] += 1
+
+
+class StatsHistory(object):
+
+  def __init__(self, resolutions, sample_interval=None):
+
+    self.resolutions = resolutions
+    # Seconds between raw samples; level 0 holds whatever is sampled
+    self.sample_interval = sample_interval
+    self.metrics = {}
+    self.latest = {}
+    self.latest_time = None
+
+
+  def add(self, t, values):
+
+    for name, value in values.iteritems():
+      if value is None:
+        continue
+
+      history = self.metrics.get(name)
+      if history is None:
+        history = self.metrics[name] = MetricHistory(self.resolutions)
+
+      history.add(t, value)
+
+    self.latest = dict(values)
+    self.latest_time = t
+
+
+  def get(self, names=None, level=0, start=None, end=None):
+
+    if names is None:
+      names = self.metrics.keys()
+
+    result = {}
+    for name in names:
+      history = self.metrics.get(name)
+      if history and 0 <= level < len(history.levels):
+        result[name] = history.levels[level].items(start, end)
+
+    return result
+
+
+  def get_level(self, start):
+
+    # Finest level whose buffers reach back to start
+    if start is not None and self.latest_time is not None:
+      for level, (interval, size) in enumerate(self.resolutions):
+        if level == 0 and self.sample_interval:
+          interval = max(interval, self.sample_interval)
+        if self.latest_time - start <= interval * size:
+          return level
+
+    return 0
+
+
+  def mean(self, names=None, start=None, end=None, level=None):
+
+    if level is None:
+      level = self.get_level(start)
+
+    means = {}
+    for name, items in self.get(names, level, start, end).iteritems():
+      if items:
+        means[name] = sum(v for t, v in items) / len(items)
+
+    return means
+
+
+class CounterRates(object):
+
+  def __init__(self):
+
+    self._time = None
+    self._counters = {}
+
+
+  def update(self, t, counters):
+
+    rates = {}
+
+    if self._time is not None and t > self._time:
+      elapsed = t - self._time
+      for name, value in counters.iteritems():
+        if name in self._counters and value >= self._counters[name]:
+          rates[name] = (value - self._counters[name]) / elapsed
+
+    self._time = t
+    self._counters = dict(counters)
+
+    return rates
+
+
+class SessionStatsDecoder(object):
+
+  def __init__(self, metrics=None):
+
+    # Index of each tracked metric in the session_stats_alert values
+    self.indexes = {}
+    for name, index in metrics or ():
+      if name in COUNTER_METRICS or name in GAUGE_METRICS:
+        self.indexes[name] = index
+
+    self._rates = CounterRates()
+
+
+  def decode_values(self, t, values):
+
+    counters = {}
+    gauges = {}
+    is_dict = isinstance(values, dict)
+
+    for name, index in self.indexes.iteritems():
+      value = values.get(name) if is_dict else values[index]
+      if value is None:
+        continue
+
+      if name in COUNTER_METRICS:
+        counters[COUNTER_METRICS[name]] = value
+      else:
+        gauges[GAUGE_METRICS[name]] = value
+
+    gauges.update(self._rates.update(t, counters))
+
+    return gauges
+
+
+  def decode_status(self, t, status, cache_status=None):
+
+    gauges = {}
+    for field, name in STATUS_METRICS.iteritems():
+      gauges[name] = getattr(status, field, None)
+
+    if cache_status is not None:
+      counters = {}
+      for field, name in CACHE_COUNTER_METRICS.iteritems():
+        value = getattr(cache_status, field, None)
+        if value is not None:
+          counters[name] = value
+
+      # blocks_read includes cache hits here but not on newer versions
+      if "blocks_read" in counters and "cache_hits" in counters:
+        counters["blocks_read"] -= counters["cache_hits"]
+
+      for field, name in CACHE_GAUGE_METRICS.iteritems():
+        gauges[name] = getattr(cache_status, field, None)
+
+      gauges.update(self._rates.update(t, counters))
+
+    return gauges
+
+
+class ProcessSampler(object):
+
+  def __init__(self):
+
+    self._page_size = os.sysconf("SC_PAGE_SIZE") \
+      if hasattr(os, "sysconf") else 4096
+    self._cpu = None
+
+
+  def get_rss(self, path="/proc/self/statm"):
+
+    try:
+      with open(path) as f:
+        return int(f.read().split()[1]) * self._page_size
+    except (IOError, ValueError, IndexError):
+      return None
+
+
+  def sample(self, t):
+
+    times = os.times()
+    cpu_time = times[0] + times[1]
+
+    cpu = None
+    if self._cpu is not None and t > self._cpu[0]:
+      cpu = (cpu_time - self._cpu[1]) / (t - self._cpu[0])
+
+    self._cpu = (t, cpu_time)
+
+    return {
+      "rss": self.get_rss(),
+      "cpu": cpu,
+    }
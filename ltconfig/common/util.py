@@ -35,6 +35,7 @@
 
 
 import copy
+import struct
 import logging
 
 
@@ -96,6 +97,20 @@ def cancel_calls(calls):
       call.cancel()
 
 
+# Section: Values
+
+def values_equal(a, b):
+
+  # Floats read back from libtorrent < 1.1.x are single precision
+  if isinstance(a, float) or isinstance(b, float):
+    try:
+      return struct.pack("f", a) == struct.pack("f", b)
+    except (struct.error, TypeError):
+      pass
+
+  return a == b
+
+
 # Section: Dictionary
 
 def copy_dict_value(src, dest, src_key, dest_key, use_deepcopy=False):
@@ -34,27 +34,57 @@
 #
 
 
-import re
+import time
+import fnmatch
 import logging
 
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredLock
+from twisted.internet.threads import deferToThread
+from twisted.internet.task import LoopingCall
+
 from deluge._libtorrent import lt as libtorrent
 from deluge.plugins.pluginbase import CorePluginBase
 import deluge.component as component
 import deluge.configmanager
 from deluge.core.rpcserver import export
+from deluge.event import DelugeEvent
 
 from common.plugin import (
   PLUGIN_NAME, MODULE_NAME,
   LOG_HANDLER,
 )
 
-from common.config.file import init_config
+from common.config.file import init_config, ConfigWriter
+from common.util import values_equal
 from common.config.plugin import (
   CONFIG_VERSION, CONFIG_DEFAULTS, CONFIG_SPECS,
 )
 
+from common.schema import (
+  PACK_MAIN, PACK_DHT,
+  get_schema,
+)
+
+from common.metrics import ApplyMetrics
+from common.history import SnapshotStore
+from common.guard import ApplyGuard
+from common.stats import (
+  StatsHistory, SessionStatsDecoder, ProcessSampler
+)
+from common.controllers import CONTROLLERS
+from common.schedule import WeeklySchedule, validate_schedule
+from common.rules import RulesEngine, validate_rules
+from common.experiment import Experiment
+from common.memory import MIB, estimate_memory, solve_memory_budget
+
+from common.hardware import (
+  get_hardware_facts, get_hardware_preset, get_total_memory,
+)
+
 from common.presets import (
-  LIBTORRENT_DEFAULTS, MIN_MEMORY_USAGE, HIGH_PERFORMANCE_SEED
+  LIBTORRENT_DEFAULTS, MIN_MEMORY_USAGE, HIGH_PERFORMANCE_SEED,
+  PRESET_HARDWARE, PRESET_MEMORY_BUDGET,
 )
 
 
@@ -76,8 +106,73 @@ DEPRECATED_FLOATS = [
   "share_ratio_limit"
 ]
 
+PRESETS = {
+  1: LIBTORRENT_DEFAULTS,
+  2: HIGH_PERFORMANCE_SEED,
+  3: MIN_MEMORY_USAGE,
+}
+
 NETWORK_SERVICES = ["dht", "lsd", "natpmp", "upnp"]
 
+# Number of apply records kept for get_apply_metrics.
+APPLY_HISTORY_SIZE = 50
+
+# Number of daemon startups kept for get_startup_metrics.
+STARTUP_HISTORY_SIZE = 20
+
+# Stats history levels as (seconds per sample, number of samples).
+STATS_RESOLUTIONS = [
+  (1, 300),
+  (60, 1440),
+  (3600, 720),
+]
+
+# Layers merged into the effective settings, lowest priority first.
+# Controllers sit below the preferences so pinned values always win.
+SETTINGS_LAYERS = [
+  "cache_tuner",
+  "peer_controller",
+  "preferences",
+  "schedule",
+  "rules",
+  "experiment",
+  "override",
+]
+
+# Settings that affect every network service (listen sockets, proxying).
+NETWORK_SETTINGS = [
+  "listen_interfaces",
+  "outgoing_interfaces",
+  "ssl_listen",
+  "anonymous_mode",
+  "force_proxy",
+  "proxy_*",
+]
+
+# Setting name patterns that require a network service to be restarted.
+NETWORK_SERVICE_DEPENDENCIES = {
+  "dht": ["dht.*", "dht_*", "use_dht_as_fallback"] + NETWORK_SETTINGS,
+  "lsd": ["broadcast_lsd", "local_service_announce_interval"] +
+    NETWORK_SETTINGS,
+  "natpmp": NETWORK_SETTINGS,
+  "upnp": ["upnp_ignore_nonrouters"] + NETWORK_SETTINGS,
+}
+
+
+class LtConfigSettingsChangedEvent(DelugeEvent):
+  """
+  Emitted when live libtorrent settings change.
+  """
+
+  def __init__(self, revision, settings):
+    """
+    :param revision: the settings revision after the change
+    :type revision: int
+    :param settings: the changed settings and their new values
+    :type settings: dict
+    """
+    self._args = [revision, settings]
+
 
 class Core(CorePluginBase):
 
@@ -86,31 +181,126 @@ class Core(CorePluginBase):
     super(Core, self).__init__(plugin_name)
 
     self._config = None
+    self._apply_call = None
+    self._apply_deferreds = []
+    self._apply_label = None
+    self._apply_lock = DeferredLock()
+    self._metrics = ApplyMetrics(APPLY_HISTORY_SIZE)
+    self._preset_cache = None
+    self._preferences_active = False
+    self._guard = None
+    self._stats = StatsHistory(STATS_RESOLUTIONS)
+    self._stats_loop = None
+    self._stats_alerts = False
+    self._overlays = dict((layer, {}) for layer in SETTINGS_LAYERS
+      if layer != "preferences")
+    self._controllers = {}
+    self._controller_loops = {}
+    self._schedule_call = None
+    self._schedule_slot = None
+    self._override_call = None
+    self._rules_loop = None
+    self._experiment = None
+    self._experiment_call = None
 
 
   def enable(self):
 
     log.debug("Enabling Core...")
 
+    self._startup = {
+      "started": time.time(),
+      "mode": None,
+      "applied": None,
+      "first_upload": None,
+    }
+
+    # No torrents are loaded yet when enabled during daemon startup
+    daemon_start = not component.get("TorrentManager").torrents
+
+    metrics = self._metrics
+    record = metrics.begin("enable")
+
     self._session = component.get("Core").session
-    self._config = deluge.configmanager.ConfigManager(
-        CONFIG_FILE, CONFIG_DEFAULTS)
 
-    self._initial_settings = self._get_session_settings(self._session)
-    self._default_settings = self.get_preset(1)
+    with metrics.stage("load_config", record):
+      self._config = self._load_config()
+      self._config_writer = ConfigWriter(self._config,
+        self._config["save_delay"])
+
+    with metrics.stage("schema", record):
+      self._schema = get_schema(self._session, libtorrent.version,
+        SETTING_EXCLUSIONS)
+
+    with metrics.stage("get_session_settings", record):
+      self._initial_settings = self._get_session_settings(self._session)
+
+    # Presets are diffed against the initial settings
+    self._preset_cache = None
+
+    with metrics.stage("get_preset", record):
+      self._default_settings = self.get_preset(1)
+
+    # Seed from the clock so revisions held by clients from a previous
+    # run are older than any revision handed out by this one.
+    self._revision = int(time.time())
+    self._live_settings = dict(self._initial_settings)
+    self._key_revisions = dict.fromkeys(self._live_settings, self._revision)
 
     self._settings = self._config["settings"]
     self._normalize_settings(self._settings)
+    self._applied_settings = {}
+
+    # Saved preferences are only applied once asked to; overlays applied
+    # before then must not carry them along
+    self._preferences_active = self._config["apply_on_start"]
+
+    self._history = SnapshotStore(self._config["history_size"],
+      self._config["history"])
+    self._record_snapshot("initial")
+
+    with metrics.stage("stats", record):
+      self._start_stats()
+      self._start_controllers()
+
+    with metrics.stage("schedule", record):
+      self._start_schedule()
+      self._update_overrides()
+
+    with metrics.stage("rules", record):
+      self._start_rules()
+
+    metrics.end(record)
+    log.debug("Enable took %.1f ms: %s", record["duration"], record["stages"])
 
     if self._config["apply_on_start"]:
-      self._apply_settings(self._settings)
+      self._applied_settings = self._get_effective_settings()
+
+      # Applied before returning since torrents are only resumed after
+      # plugins are enabled at startup
+      if self._config["early_apply"]:
+        mode = "early"
+        self._apply_settings_now(self._applied_settings, "early_apply")
+        self._startup["applied"] = time.time() - self._startup["started"]
+      else:
+        mode = "deferred"
+        d = self._apply_settings(self._applied_settings, "apply_on_start")
+        d.addCallback(self._on_startup_applied)
+        d.addErrback(self._log_apply_failure)
+
+      # Only daemon startups are recorded, not enabling at runtime
+      if daemon_start:
+        self._startup["mode"] = mode
+    elif any(self._overlays.itervalues()):
+      d = self._queue_apply("enable")
+      d.addErrback(self._log_apply_failure)
 
     log.debug("Core enabled")
 
 
   def _load_config(self):
 
-    config = deluge.configmanager.ConfigManager(CONFIG_FILE)
+    config = deluge.configmanager.ConfigManager(CONFIG_FILE, CONFIG_DEFAULTS)
 
     old_ver = init_config(config, CONFIG_DEFAULTS,
       CONFIG_VERSION, CONFIG_SPECS)
@@ -125,8 +315,26 @@ class Core(CorePluginBase):
 
     log.debug("Disabling Core...")
 
+    if self._guard:
+      self._guard.cancel("plugin disabled")
+
+    self._stop_experiment("plugin disabled")
+    self._stop_controllers()
+    self._stop_rules()
+    self._stop_stats()
+
+    if self._schedule_call and self._schedule_call.active():
+      self._schedule_call.cancel()
+
+    if self._override_call and self._override_call.active():
+      self._override_call.cancel()
+
+    if self._apply_call and self._apply_call.active():
+      self._apply_call.cancel()
+      self._flush_apply()
+
     if self._config:
-      self._config.save()
+      self._config_writer.flush()
 
     deluge.configmanager.close(CONFIG_FILE)
 
@@ -135,12 +343,351 @@ class Core(CorePluginBase):
     log.debug("Core disabled")
 
 
+  @export
+  def get_state(self):
+
+    log.debug("Get state")
+
+    def build_state(settings):
+      state = self._get_settings_since(None)
+      state.update({
+        "version": libtorrent.version,
+        "schema": self._schema.export(),
+        "original_settings": dict(self._initial_settings),
+        "preferences": self.get_preferences(),
+      })
+
+      return state
+
+    return self._read_session_settings().addCallback(build_state)
+
+
   @export
   def get_settings(self):
 
     log.debug("Get settings")
 
-    return self._get_session_settings(self._session)
+    return self._read_session_settings()
+
+
+  @export
+  def get_settings_since(self, revision=None):
+
+    log.debug("Get settings since revision %s", revision)
+
+    return self._read_session_settings().addCallback(
+      lambda settings: self._get_settings_since(revision))
+
+
+  def _get_settings_since(self, revision):
+
+    if revision is None or revision > self._revision:
+      settings = dict(self._live_settings)
+    else:
+      settings = {}
+      for k, rev in self._key_revisions.iteritems():
+        if rev > revision:
+          settings[k] = self._live_settings[k]
+
+    return {
+      "revision": self._revision,
+      "settings": settings,
+    }
+
+
+  @export
+  def get_apply_metrics(self):
+
+    log.debug("Get apply metrics")
+
+    return self._metrics.export()
+
+
+  @export
+  def get_stats_info(self):
+
+    log.debug("Get stats info")
+
+    return {
+      "metrics": sorted(self._stats.metrics),
+      "resolutions": [list(r) for r in STATS_RESOLUTIONS],
+      "latest": dict(self._stats.latest),
+      "latest_time": self._stats.latest_time,
+    }
+
+
+  @export
+  def get_stats(self, names=None, resolution=0, start=None, end=None):
+
+    log.debug("Get stats: %s", names)
+
+    series = self._stats.get(names, resolution, start, end)
+
+    return dict((k, [list(i) for i in v]) for k, v in series.iteritems())
+
+
+  @export
+  def get_controller_status(self, name=None):
+
+    log.debug("Get controller status: %s", name)
+
+    if name is not None:
+      return self._get_controller(name).status()
+
+    return dict((k, v.status()) for k, v in self._controllers.iteritems())
+
+
+  @export
+  def set_controller_options(self, name, options):
+
+    log.debug("Set controller options: %s", name)
+
+    controller = self._get_controller(name)
+    controller.configure(options)
+
+    self._config["controllers"][name] = dict(controller.options)
+    self._config_writer.schedule()
+
+    self._schedule_controller(name)
+
+    if not controller.enabled and self._overlays[name]:
+      d = self._set_overlay(name, {}, "%s disabled" % name)
+      d.addErrback(self._log_apply_failure)
+
+    return controller.status()
+
+
+  @export
+  def get_schedule(self):
+
+    log.debug("Get schedule")
+
+    schedule = validate_schedule(self._config["schedule"])
+
+    next_transition = None
+    if schedule["enabled"]:
+      next_transition = self._schedule.get_next_transition()
+
+    schedule.update({
+      "active_slot": self._schedule_slot,
+      "next_transition": next_transition,
+      "active_settings": dict(self._overlays["schedule"]),
+    })
+
+    return schedule
+
+
+  @export
+  def set_schedule(self, schedule):
+
+    log.debug("Set schedule")
+
+    schedule = validate_schedule(schedule)
+
+    # Resolved before saving so a profile that cannot be applied is
+    # never persisted
+    for profile in schedule["profiles"].itervalues():
+      self._resolve_profile(profile)
+
+    config_schedule = self._config["schedule"]
+    config_schedule.clear()
+    config_schedule.update(schedule)
+    self._config_writer.schedule()
+
+    self._start_schedule()
+
+    return self._queue_apply("schedule")
+
+
+  @export
+  def get_overrides(self):
+
+    log.debug("Get overrides")
+
+    now = time.time()
+    overrides = []
+    for override in self._config["overrides"]:
+      override = dict(override)
+      override["remaining"] = max(0.0, override["expires"] - now)
+      overrides.append(override)
+
+    return overrides
+
+
+  @export
+  def add_override(self, settings, ttl, label=""):
+
+    log.debug("Add override for %.0f seconds: %s", ttl, label)
+
+    if ttl <= 0:
+      raise ValueError("Override ttl must be positive: %r" % ttl)
+
+    settings = dict(settings)
+    self._normalize_settings(settings)
+
+    overrides = self._config["overrides"]
+    override_id = max([o["id"] for o in overrides] + [0]) + 1
+    now = time.time()
+
+    overrides.append({
+      "id": override_id,
+      "label": label,
+      "settings": settings,
+      "created": now,
+      "expires": now + ttl,
+    })
+    self._config_writer.schedule()
+
+    self._update_overrides()
+
+    d = self._queue_apply("override %d" % override_id)
+    d.addCallback(lambda changes: override_id)
+
+    return d
+
+
+  @export
+  def remove_override(self, override_id):
+
+    log.debug("Remove override %d", override_id)
+
+    overrides = self._config["overrides"]
+    remaining = [o for o in overrides if o["id"] != override_id]
+    if len(remaining) == len(overrides):
+      raise ValueError("Unknown override: %r" % override_id)
+
+    overrides[:] = remaining
+    self._config_writer.schedule()
+
+    self._update_overrides()
+
+    return self._queue_apply("override %d removed" % override_id)
+
+
+  @export
+  def get_rules(self):
+
+    log.debug("Get rules")
+
+    return validate_rules(self._config["rules"])
+
+
+  @export
+  def set_rules(self, rules):
+
+    log.debug("Set rules")
+
+    rules = validate_rules(rules)
+
+    config_rules = self._config["rules"]
+    config_rules.clear()
+    config_rules.update(rules)
+    self._config_writer.schedule()
+
+    self._stop_rules()
+    self._start_rules()
+
+    return self._set_overlay("rules", {}, "rules")
+
+
+  @export
+  def get_rules_status(self):
+
+    log.debug("Get rules status")
+
+    status = self._rules.status()
+    status["settings"] = dict(self._overlays["rules"])
+
+    return status
+
+
+  @export
+  def start_experiment(self, options):
+
+    log.debug("Start experiment")
+
+    if self._experiment and self._experiment.state == "running":
+      raise ValueError("An experiment is already running")
+
+    experiment = Experiment(options)
+    arm_settings = [self._resolve_profile(arm) for arm in experiment.arms]
+
+    self._experiment = experiment
+    self._experiment_settings = arm_settings
+    experiment.start()
+
+    self._start_experiment_slot()
+
+    return experiment.status()
+
+
+  @export
+  def stop_experiment(self):
+
+    log.debug("Stop experiment")
+
+    return self._stop_experiment("stopped")
+
+
+  @export
+  def get_experiment(self):
+
+    log.debug("Get experiment")
+
+    if not self._experiment:
+      return None
+
+    return self._experiment.status()
+
+
+  @export
+  def estimate_memory(self, settings=None):
+
+    log.debug("Estimate memory")
+
+    # Proposed preferences replace the current ones over the initial settings
+    if settings is None:
+      proposed = dict(self._live_settings)
+    else:
+      proposed = dict(self._initial_settings)
+      proposed.update(settings)
+
+    num_torrents, num_peers = self._get_session_counts()
+
+    estimate = estimate_memory(proposed, num_torrents, num_peers,
+      get_total_memory())
+    estimate["rss"] = self._stats.latest.get("rss")
+
+    return estimate
+
+
+  @export
+  def get_startup_metrics(self):
+
+    log.debug("Get startup metrics")
+
+    history = list(self._config["startup_history"])
+
+    # Mean time to first upload per startup mode
+    modes = {}
+    for startup in history:
+      if startup["first_upload"] is not None:
+        modes.setdefault(startup["mode"], []).append(startup["first_upload"])
+
+    return {
+      "current": dict(self._startup),
+      "history": history,
+      "first_upload_means": dict((mode, sum(v) / len(v))
+        for mode, v in modes.iteritems()),
+    }
+
+
+  @export
+  def get_schema(self):
+
+    log.debug("Get schema")
+
+    return self._schema.export()
 
 
   @export
@@ -156,27 +703,10 @@ class Core(CorePluginBase):
 
     log.debug("Get preset %d" % preset)
 
-    settings = {}
-
-    if preset == 1:
-      settings = dict(LIBTORRENT_DEFAULTS)
-    elif preset == 2:
-      settings = dict(HIGH_PERFORMANCE_SEED)
-    elif preset == 3:
-      settings = dict(MIN_MEMORY_USAGE)
-
-    for key in settings.keys():
-      # Presets use integer values in place of floats (for >= 1.1.x).
-      # Need to convert to float for earlier versions.
-      if key in DEPRECATED_FLOATS and \
-          (libtorrent.version_major < 1 or \
-          (libtorrent.version_major == 1 and libtorrent.version_minor < 1)):
-        settings[key] = settings[key] / 100.0
+    if preset == PRESET_MEMORY_BUDGET:
+      return self._get_memory_budget_preset()[1]
 
-      if key not in self._initial_settings or settings[key] == self._initial_settings[key]:
-        del settings[key]
-
-    return settings
+    return dict(self._get_preset_cache()["diff"].get(preset, {}))
 
 
   @export
@@ -185,172 +715,971 @@ class Core(CorePluginBase):
     log.debug("Set preferences")
 
     self._config["apply_on_start"] = preferences["apply_on_start"]
+    if "apply_delay" in preferences:
+      self._config["apply_delay"] = max(0.0, float(preferences["apply_delay"]))
+    if "early_apply" in preferences:
+      self._config["early_apply"] = bool(preferences["early_apply"])
+    if "memory_budget" in preferences:
+      self._config["memory_budget"] = max(0, int(preferences["memory_budget"]))
 
     settings = preferences["settings"]
     self._normalize_settings(settings)
 
-    old_settings = dict(self._settings)
-    self._settings.clear()
-    self._settings.update(settings)
+    if self._guard:
+      self._guard.cancel("superseded by new preferences")
 
-    self._config.save()
+    if preferences.get("guard"):
+      return self._start_guard(settings, preferences["guard"])
 
-    for key in old_settings:
-      if key not in settings:
-        settings[key] = self._initial_settings[key]
+    self._replace_settings(settings)
 
-    self._apply_settings(settings)
+    return self._queue_apply("set_preferences")
 
 
   @export
-  def get_preferences(self):
+  def get_guard_status(self):
 
-    log.debug("Get preferences")
+    log.debug("Get guard status")
 
-    preferences = {
-      "apply_on_start": self._config["apply_on_start"],
-      "settings": dict(self._settings),
-    }
+    if not self._guard:
+      return None
 
-    return preferences
+    return self._guard.status()
 
 
-  def _convert_from_libtorrent_settings(self, settings_obj, prefix=""):
+  @export
+  def get_snapshots(self):
 
-    settings = {}
+    log.debug("Get snapshots")
 
-    if type(settings_obj) == dict:
-      for k in settings_obj:
-        name = prefix + k
+    return self._history.list()
 
-        if name in SETTING_EXCLUSIONS:
-          continue
 
-        settings[name] = settings_obj[k]
+  @export
+  def rollback_snapshot(self, snapshot_id):
 
-      return settings
+    log.debug("Rollback to snapshot %d", snapshot_id)
 
-    for k in dir(settings_obj):
-      name = prefix + k
+    settings = self._history.get(snapshot_id)
+    if settings is None:
+      raise ValueError("Unknown snapshot: %r" % snapshot_id)
 
-      if k.startswith("_") or name in SETTING_EXCLUSIONS:
-        continue
+    self._normalize_settings(settings)
 
-      try:
-        v = getattr(settings_obj, k)
-      except TypeError:
-        continue
+    if self._guard:
+      self._guard.cancel("superseded by rollback")
 
-      val_type = type(v)
-      if val_type.__module__ == "libtorrent":
-        try:
-          v = int(v)
-        except ValueError:
-          continue
+    self._replace_settings(settings)
 
-      settings[name] = v
+    return self._queue_apply("rollback %d" % snapshot_id)
 
-    return settings
 
+  @export
+  def get_preferences(self):
 
-  def _convert_to_libtorrent_settings(self, settings, settings_obj, prefix=""):
+    log.debug("Get preferences")
 
-    for name in settings:
-      if not name.startswith(prefix):
-        continue
+    preferences = {
+      "apply_on_start": self._config["apply_on_start"],
+      "apply_delay": self._config["apply_delay"],
+      "memory_budget": self._config["memory_budget"],
+      "early_apply": self._config["early_apply"],
+      "settings": dict(self._settings),
+    }
 
-      k = re.sub(r"^%s" % re.escape(prefix), "", name)
+    return preferences
 
-      if type(settings_obj) == dict:
-        if k in settings_obj:
-          settings_obj[k] = settings[name]
-      else:
-        if k in dir(settings_obj):
-          val_type = type(getattr(settings_obj, k))
-          v = val_type(settings[name])
 
-          setattr(settings_obj, k, v)
+  def _convert_from_libtorrent_settings(self, settings_obj, pack=PACK_MAIN):
 
+    return self._schema.read(settings_obj, pack)
 
-  def _get_session_settings(self, session):
+
+  def _convert_to_libtorrent_settings(self, settings, settings_obj,
+      pack=PACK_MAIN):
+
+    self._schema.write(settings, settings_obj, pack)
+
+
+  def _fetch_session_settings(self, session):
 
     if hasattr(session, "get_settings"):
       settings_obj = session.get_settings()
     else:
       settings_obj = session.settings()
 
+    dht_settings_obj = None
+    if hasattr(session, "get_dht_settings"):
+      dht_settings_obj = session.get_dht_settings()
+
+    return settings_obj, dht_settings_obj
+
+
+  def _convert_session_settings(self, settings_objs):
+
+    settings_obj, dht_settings_obj = settings_objs
+
     settings = self._convert_from_libtorrent_settings(settings_obj)
 
-    if hasattr(session, "get_dht_settings"):
-      dht_settings = self._convert_from_libtorrent_settings(
-        session.get_dht_settings(), "dht.")
-      settings.update(dht_settings)
+    if dht_settings_obj is not None:
+      settings.update(self._convert_from_libtorrent_settings(
+        dht_settings_obj, PACK_DHT))
 
     return settings
 
 
-  def _set_session_settings(self, session, settings):
+  def _get_session_settings(self, session):
 
-    if hasattr(session, "get_settings"):
-      settings_obj = session.get_settings()
-    else:
-      settings_obj = session.settings()
+    return self._convert_session_settings(
+      self._fetch_session_settings(session))
 
-    self._convert_to_libtorrent_settings(settings, settings_obj)
 
-    if hasattr(session, "apply_settings"):
-      session.apply_settings(settings_obj)
-    else:
-      session.set_settings(settings_obj)
+  def _read_session_settings(self):
 
-    if hasattr(session, "get_dht_settings"):
-      settings_obj = session.get_dht_settings()
-      self._convert_to_libtorrent_settings(settings, settings_obj, "dht.")
-      session.set_dht_settings(settings_obj)
+    # Serialized with applies so a read fetched before a commit cannot
+    # land after it and overwrite the live settings with stale values
+    return self._apply_lock.run(self._do_read_session_settings)
 
-    self._stop_network_services()
-    self._start_network_services()
 
+  def _do_read_session_settings(self):
 
-  def _normalize_settings(self, settings):
+    # Only the libtorrent calls run on the reactor; conversion is threaded
+    settings_objs = self._fetch_session_settings(self._session)
 
-    for k in settings.keys():
-      if k not in self._initial_settings:
-        del settings[k]
-      else:
-        val_type = type(self._initial_settings[k])
-        try:
-          settings[k] = val_type(settings[k])
-        except TypeError, ValueError:
-          settings[k] = self._initial_settings[k]
+    d = deferToThread(self._convert_session_settings, settings_objs)
+    d.addCallback(self._update_live_settings_from_session)
 
+    return d
 
-  def _apply_settings(self, settings):
 
-    for k, v in settings.iteritems():
-      if isinstance(v, unicode):
-        try:
-          settings[k] = str(v)
-        except UnicodeEncodeError:
-          del settings[k]
+  def _update_live_settings_from_session(self, settings):
 
-    self._set_session_settings(self._session, settings)
+    self._update_live_settings(settings)
 
+    return settings
 
-  def _start_network_services(self):
-    config = component.get("PreferencesManager").config
 
-    for service in NETWORK_SERVICES:
-      if config[service]:
-        method = getattr(self._session, "start_%s" % service, None)
-        if method:
-          method()
+  def _set_session_settings(self, session, settings, kind="apply"):
 
+    metrics = self._metrics
+    record = metrics.begin(kind)
 
-  def _stop_network_services(self):
-    config = component.get("PreferencesManager").config
+    with metrics.stage("fetch", record):
+      settings_objs = self._fetch_session_settings(session)
+
+    d = deferToThread(self._prepare_session_settings, session,
+      settings_objs, settings, record)
+    d.addCallback(self._commit_session_settings, session, record)
+    d.addBoth(self._end_apply, record)
+
+    return d
+
+
+  def _prepare_session_settings(self, session, settings_objs, settings,
+      record):
+
+    # Runs in a thread, so only the fetched settings objects are touched
+    metrics = self._metrics
+    settings_obj, dht_settings_obj = settings_objs
+
+    with metrics.stage("thread.convert", record):
+      for k, v in settings.items():
+        if isinstance(v, unicode):
+          try:
+            settings[k] = str(v)
+          except UnicodeEncodeError:
+            del settings[k]
+
+      current = self._convert_session_settings(settings_objs)
+
+    with metrics.stage("thread.diff", record):
+      changes = {}
+      main_changes = {}
+      dht_changes = {}
+
+      for k, v in settings.iteritems():
+        if k in current and not values_equal(current[k], v):
+          changes[k] = v
+
+          if self._schema.get(k).pack == PACK_DHT:
+            dht_changes[k] = v
+          else:
+            main_changes[k] = v
+
+    with metrics.stage("thread.build", record):
+      settings_pack = None
+      if main_changes:
+        if hasattr(session, "apply_settings"):
+          # Settings pack only needs the keys that changed
+          settings_pack = main_changes
+        else:
+          self._convert_to_libtorrent_settings(main_changes, settings_obj)
+          settings_pack = settings_obj
+
+      dht_settings_pack = None
+      if dht_changes and dht_settings_obj is not None:
+        self._convert_to_libtorrent_settings(dht_changes, dht_settings_obj,
+          PACK_DHT)
+        dht_settings_pack = dht_settings_obj
+
+    return changes, settings_pack, dht_settings_pack
+
+
+  def _commit_session_settings(self, prepared, session, record):
+
+    metrics = self._metrics
+    changes, settings_pack, dht_settings_pack = prepared
+
+    if not changes:
+      log.debug("Session settings already up to date")
+      return changes
+
+    if settings_pack is not None:
+      with metrics.stage("apply_settings", record):
+        if hasattr(session, "apply_settings"):
+          session.apply_settings(settings_pack)
+        else:
+          session.set_settings(settings_pack)
+
+    if dht_settings_pack is not None:
+      with metrics.stage("dht_apply", record):
+        session.set_dht_settings(dht_settings_pack)
+
+    services = self._get_affected_services(changes)
+    if services:
+      log.debug("Restarting network services: %s", services)
+      with metrics.stage("network_services", record):
+        self._stop_network_services(services)
+        self._start_network_services(services)
+
+    self._update_live_settings(changes)
+
+    log.debug("Applied settings: %s", changes)
+
+    return changes
+
+
+  def _apply_settings_now(self, settings, kind):
+
+    # Applies in one batch on the reactor thread before returning
+    metrics = self._metrics
+    record = metrics.begin(kind)
+
+    try:
+      with metrics.stage("fetch", record):
+        settings_objs = self._fetch_session_settings(self._session)
+
+      with metrics.stage("prepare", record):
+        prepared = self._prepare_session_settings(self._session,
+          settings_objs, dict(settings), record)
+
+      changes = self._commit_session_settings(prepared, self._session, record)
+    except Exception as e:
+      log.error("Unable to apply settings: %s", e)
+      changes = {}
+
+    return self._end_apply(changes, record)
+
+
+  def _on_startup_applied(self, changes):
+
+    self._startup["applied"] = time.time() - self._startup["started"]
+
+    return changes
+
+
+  def _end_apply(self, result, record):
+
+    changes = result if isinstance(result, dict) else {}
+    self._metrics.end(record, changes)
+
+    log.debug("Apply (%s) took %.1f ms (%.1f ms on reactor): %s",
+      record["kind"], record["duration"], record["reactor"], record["stages"])
+
+    return result
+
+
+  def _log_apply_failure(self, failure):
+
+    log.error("Unable to apply settings: %s", failure.getErrorMessage())
+
+
+  def _replace_settings(self, settings):
+
+    self._settings.clear()
+    self._settings.update(settings)
+    self._preferences_active = True
+
+
+  def _start_guard(self, settings, options):
+
+    prior_settings = dict(self._settings)
+
+    def apply_settings():
+      self._replace_settings(settings)
+      return self._queue_apply("guarded")
+
+    def revert_settings():
+      self._replace_settings(prior_settings)
+      d = self._queue_apply("guard revert")
+      d.addErrback(self._log_apply_failure)
+
+    self._guard = ApplyGuard(options, self._sample_session_status,
+      apply_settings, revert_settings)
+    self._guard.start()
+
+    return self._guard.applied
+
+
+  def _sample_session_status(self):
+
+    return dict(self._stats.latest)
+
+
+  def _start_stats(self):
+
+    self._stats_process = ProcessSampler()
+
+    if (hasattr(self._session, "post_session_stats") and
+        hasattr(libtorrent, "session_stats_metrics")):
+      # Map metric names to value indexes once; alerts only carry values
+      metrics = [(m.name, m.value_index)
+        for m in libtorrent.session_stats_metrics()]
+      self._stats_decoder = SessionStatsDecoder(metrics)
+      component.get("AlertManager").register_handler(
+        "session_stats_alert", self._on_session_stats_alert)
+      self._stats_alerts = True
+      sample_func = self._session.post_session_stats
+    else:
+      self._stats_decoder = SessionStatsDecoder()
+      sample_func = self._sample_stats_from_status
+
+    self._stats.sample_interval = self._config["stats_interval"]
+    self._stats_loop = LoopingCall(sample_func)
+    self._stats_loop.start(self._config["stats_interval"], now=False)
+
+
+  def _stop_stats(self):
+
+    if self._stats_loop and self._stats_loop.running:
+      self._stats_loop.stop()
+
+    self._stats_loop = None
+
+    if self._stats_alerts:
+      component.get("AlertManager").deregister_handler(
+        self._on_session_stats_alert)
+      self._stats_alerts = False
+
+
+  def _on_session_stats_alert(self, alert):
+
+    now = time.time()
+    values = self._stats_decoder.decode_values(now, alert.values)
+    self._add_stats_sample(now, values)
+
+
+  def _sample_stats_from_status(self):
+
+    now = time.time()
+
+    cache_status = None
+    if hasattr(self._session, "get_cache_status"):
+      cache_status = self._session.get_cache_status()
+
+    values = self._stats_decoder.decode_status(now, self._session.status(),
+      cache_status)
+    self._add_stats_sample(now, values)
+
+
+  def _add_stats_sample(self, t, values):
+
+    values.update(self._stats_process.sample(t))
+    values["num_torrents"] = len(component.get("TorrentManager").torrents)
+
+    self._stats.add(t, values)
+
+    if (self._startup["mode"] and self._startup["first_upload"] is None and
+        values.get("payload_upload_rate")):
+      self._record_first_upload(t)
+
+
+  def _record_first_upload(self, t):
+
+    self._startup["first_upload"] = t - self._startup["started"]
+
+    log.debug("First upload %.1f s after enable (%s apply)",
+      self._startup["first_upload"], self._startup["mode"])
+
+    history = self._config["startup_history"]
+    history.append(dict(self._startup))
+    del history[:-STARTUP_HISTORY_SIZE]
+    self._config_writer.schedule()
+
+
+  def _queue_apply(self, label):
+
+    # Calls within the apply window are merged into a single apply
+    self._apply_label = label
+
+    d = Deferred()
+    self._apply_deferreds.append(d)
+
+    if not self._apply_call or not self._apply_call.active():
+      self._apply_call = reactor.callLater(self._config["apply_delay"],
+        self._flush_apply)
+
+    return d
+
+
+  def _flush_apply(self):
+
+    self._apply_call = None
+    deferreds = self._apply_deferreds
+    self._apply_deferreds = []
+
+    log.debug("Applying %d queued preference changes", len(deferreds))
+
+    self._record_snapshot(self._apply_label)
+    self._config_writer.schedule()
+
+    effective = self._get_effective_settings()
+
+    settings = dict(effective)
+    for key in self._applied_settings:
+      if key not in settings:
+        settings[key] = self._initial_settings[key]
+
+    self._applied_settings = effective
+
+    # Labels may carry an id ("rollback 3"); metrics group by the source
+    kind = self._apply_label.split()[0]
+
+    d = self._apply_settings(settings, kind)
+    d.addCallbacks(self._on_flush_applied, self._on_flush_failed,
+      callbackArgs=(deferreds,), errbackArgs=(deferreds,))
+
+    return d
+
+
+  def _on_flush_applied(self, changes, deferreds):
+
+    for d in deferreds:
+      d.callback(changes)
+
+    return changes
+
+
+  def _on_flush_failed(self, failure, deferreds):
+
+    self._log_apply_failure(failure)
+
+    for d in deferreds:
+      d.errback(failure)
+
+
+  def _get_effective_settings(self):
+
+    settings = {}
+    for layer in SETTINGS_LAYERS:
+      if layer == "preferences":
+        if self._preferences_active:
+          settings.update(self._settings)
+      else:
+        settings.update(self._overlays[layer])
+
+    return settings
+
+
+  def _set_overlay(self, layer, settings, label):
+
+    self._normalize_settings(settings)
+    self._overlays[layer] = settings
+
+    return self._queue_apply(label)
+
+
+  def _get_controller(self, name):
+
+    if name not in self._controllers:
+      raise ValueError("Unknown controller: %r" % name)
+
+    return self._controllers[name]
+
+
+  def _start_controllers(self):
+
+    options = self._config["controllers"]
+
+    for name, cls in CONTROLLERS.iteritems():
+      self._controllers[name] = cls(options.get(name))
+      self._schedule_controller(name)
+
+
+  def _stop_controllers(self):
+
+    for loop in self._controller_loops.itervalues():
+      if loop.running:
+        loop.stop()
+
+    self._controller_loops.clear()
+
+
+  def _schedule_controller(self, name):
+
+    loop = self._controller_loops.pop(name, None)
+    if loop and loop.running:
+      loop.stop()
+
+    controller = self._controllers[name]
+    if controller.enabled:
+      loop = LoopingCall(self._run_controller, name)
+      loop.start(controller.options["interval"], now=False)
+      self._controller_loops[name] = loop
+
+
+  def _run_controller(self, name):
+
+    # Errors would stop the LoopingCall for good
+    try:
+      self._evaluate_controller(name)
+    except Exception as e:
+      log.error("Unable to evaluate %s: %s", name, e)
+
+
+  def _evaluate_controller(self, name):
+
+    controller = self._controllers[name]
+
+    start = time.time() - controller.options["interval"]
+    sample = self._stats.mean(None, start)
+
+    changes = controller.evaluate(sample, self._live_settings, self._settings)
+    if not changes:
+      return
+
+    log.debug("%s adjusting: %s", name, changes)
+
+    overlay = dict(self._overlays[name])
+    overlay.update(changes)
+
+    d = self._set_overlay(name, overlay, name)
+    d.addErrback(self._log_apply_failure)
+
+
+  def _start_schedule(self):
+
+    try:
+      schedule = validate_schedule(self._config["schedule"])
+    except ValueError as e:
+      log.error("Invalid schedule, not starting it: %s", e)
+      schedule = validate_schedule({})
+
+    self._schedule = WeeklySchedule(schedule["slots"])
+    self._schedule_enabled = schedule["enabled"]
+    self._schedule_profiles = schedule["profiles"]
+
+    self._update_schedule()
+
+
+  def _update_schedule(self):
+
+    if self._schedule_call and self._schedule_call.active():
+      self._schedule_call.cancel()
+
+    self._schedule_call = None
+
+    slot = None
+    profile = None
+    if self._schedule_enabled:
+      slot = self._schedule.get_active()
+      if slot is not None:
+        profile = self._schedule.slots[slot].get("profile")
+
+    if slot != self._schedule_slot:
+      log.debug("Schedule slot %s active (profile %s)", slot, profile)
+
+    self._schedule_slot = slot
+    self._overlays["schedule"] = self._get_profile_settings(profile)
+
+    if self._schedule_enabled:
+      next_transition = self._schedule.get_next_transition()
+      if next_transition is not None:
+        self._schedule_call = reactor.callLater(
+          max(0, next_transition - time.time()), self._on_schedule_transition)
+
+
+  def _on_schedule_transition(self):
+
+    self._schedule_call = None
+
+    previous = self._overlays["schedule"]
+    self._update_schedule()
+
+    if self._overlays["schedule"] != previous:
+      d = self._queue_apply("schedule")
+      d.addErrback(self._log_apply_failure)
+
+
+  def _update_overrides(self):
+
+    if self._override_call and self._override_call.active():
+      self._override_call.cancel()
+
+    self._override_call = None
+
+    now = time.time()
+    overrides = self._config["overrides"]
+
+    expired = [o for o in overrides if o["expires"] <= now]
+    if expired:
+      log.debug("Overrides expired: %s", [o["id"] for o in expired])
+      overrides[:] = [o for o in overrides if o["expires"] > now]
+      self._config_writer.schedule()
+
+    # Later overrides take precedence over earlier ones
+    settings = {}
+    for override in overrides:
+      settings.update(override["settings"])
+
+    self._overlays["override"] = settings
+
+    if overrides:
+      expires = min(o["expires"] for o in overrides)
+      self._override_call = reactor.callLater(max(0, expires - now),
+        self._on_override_expired)
+
+    return expired
+
+
+  def _on_override_expired(self):
+
+    self._override_call = None
+
+    if self._update_overrides():
+      d = self._queue_apply("override expired")
+      d.addErrback(self._log_apply_failure)
+
+
+  def _start_rules(self):
+
+    try:
+      rules = validate_rules(self._config["rules"])
+    except ValueError as e:
+      log.error("Invalid rules, not starting them: %s", e)
+      rules = validate_rules({})
+    self._rules = RulesEngine(rules["rules"])
+
+    if rules["enabled"] and rules["rules"]:
+      self._rules_interval = rules["interval"]
+      self._rules_loop = LoopingCall(self._run_rules)
+      self._rules_loop.start(self._rules_interval, now=False)
+
+
+  def _stop_rules(self):
+
+    if self._rules_loop and self._rules_loop.running:
+      self._rules_loop.stop()
+
+    self._rules_loop = None
+
+
+  def _run_rules(self):
+
+    # Errors would stop the LoopingCall for good
+    try:
+      self._evaluate_rules()
+    except Exception as e:
+      log.error("Unable to evaluate rules: %s", e)
+
+
+  def _evaluate_rules(self):
+
+    now = time.time()
+    sample = self._stats.mean(None, now - self._rules_interval)
+
+    if not self._rules.evaluate(sample, now):
+      return
+
+    settings = {}
+    for rule in self._rules.get_active():
+      settings.update(self._get_rule_settings(rule))
+
+    log.debug("Rules active: %s",
+      [r["name"] for r in self._rules.get_active()])
+
+    d = self._set_overlay("rules", settings, "rules")
+    d.addErrback(self._log_apply_failure)
+
+
+  def _get_rule_settings(self, rule):
+
+    settings = {}
+
+    if rule["preset"] is not None:
+      preset = self._get_full_preset(rule["preset"])
+      for key, value in preset.iteritems():
+        if not rule["keys"] or any(fnmatch.fnmatch(key, pattern)
+            for pattern in rule["keys"]):
+          settings[key] = value
+
+    settings.update(rule["settings"] or {})
+
+    return settings
+
+
+  def _start_experiment_slot(self):
+
+    experiment = self._experiment
+    index = experiment.arms.index(experiment.current_arm)
+
+    log.debug("Experiment slot %d: %s", len(experiment.slots) + 1,
+      experiment.current_arm["name"])
+
+    self._experiment_call = reactor.callLater(
+      experiment.options["slot_duration"], self._on_experiment_slot_end)
+
+    d = self._set_overlay("experiment",
+      dict(self._experiment_settings[index]), "experiment")
+    d.addErrback(self._log_apply_failure)
+
+
+  def _on_experiment_slot_end(self):
+
+    self._experiment_call = None
+
+    experiment = self._experiment
+    sample = self._stats.mean(experiment.options["metrics"],
+      experiment.get_sample_window())
+    experiment.end_slot(sample)
+
+    if experiment.state == "running":
+      self._start_experiment_slot()
+    else:
+      log.debug("Experiment finished: %s", experiment.results())
+      d = self._set_overlay("experiment", {}, "experiment finished")
+      d.addErrback(self._log_apply_failure)
+
+
+  def _stop_experiment(self, reason):
+
+    if self._experiment_call and self._experiment_call.active():
+      self._experiment_call.cancel()
+
+    self._experiment_call = None
+
+    if not self._experiment or self._experiment.state != "running":
+      return None
+
+    log.debug("Experiment %s", reason)
+    self._experiment.stop()
+
+    # Go straight back to the preferences
+    self._overlays["experiment"] = {}
+    if reason != "plugin disabled":
+      d = self._queue_apply("experiment %s" % reason)
+      d.addErrback(self._log_apply_failure)
+
+    return self._experiment.status()
+
+
+  def _get_profile_settings(self, name):
+
+    profile = self._schedule_profiles.get(name) if name else None
+    if not profile:
+      return {}
+
+    try:
+      return self._resolve_profile(profile)
+    except Exception as e:
+      log.error("Unable to resolve profile %r: %s", name, e)
+      return {}
+
+
+  def _resolve_profile(self, profile):
+
+    if "preset" in profile:
+      settings = self._get_full_preset(profile["preset"])
+    else:
+      settings = dict(profile["settings"])
+
+    self._normalize_settings(settings)
+
+    return settings
+
+
+  def _get_session_counts(self):
+
+    num_torrents = len(component.get("TorrentManager").torrents)
+    num_peers = self._stats.latest.get("num_peers") or 0
+
+    return num_torrents, int(num_peers)
+
+
+  def _record_snapshot(self, label):
+
+    snapshot_id = self._history.record(dict(self._settings), label)
+
+    # The store appends to the config's history dict in place
+    if snapshot_id is not None:
+      log.debug("Recorded snapshot %d (%s)", snapshot_id, label)
+      self._config_writer.schedule()
+
+
+  def _build_preset_cache(self):
+
+    presets = dict(PRESETS)
+    presets.update(self._generate_presets())
+
+    # Full values are used for overlays, which must not let preferences
+    # through; diffs against the initial settings are sent to clients
+    full = {0: dict(self._initial_settings)}
+    diff = {}
+
+    for preset, values in presets.iteritems():
+      full[preset], diff[preset] = self._convert_preset(values)
+
+    return {
+      "full": full,
+      "diff": diff,
+    }
+
+
+  def _convert_preset(self, values):
+
+    # Presets use integer values in place of floats (for >= 1.1.x).
+    # Need to convert to float for earlier versions.
+    use_floats = libtorrent.version_major < 1 or \
+      (libtorrent.version_major == 1 and libtorrent.version_minor < 1)
+
+    settings = {}
+    changed = {}
+
+    for key, value in values.iteritems():
+      if key not in self._initial_settings:
+        continue
+
+      if use_floats and key in DEPRECATED_FLOATS:
+        value = value / 100.0
+
+      settings[key] = value
+      if not values_equal(value, self._initial_settings[key]):
+        changed[key] = value
+
+    return settings, changed
+
+
+  def _get_memory_budget_preset(self):
+
+    # Solved on request since the result depends on the torrent count
+    total_memory = get_total_memory()
+
+    # Budget in MiB; defaults to half of physical memory
+    budget = self._config["memory_budget"] * MIB
+    if not budget:
+      budget = (total_memory or 0) / 2
+
+    if not budget:
+      return {}, {}
+
+    num_torrents = self._get_session_counts()[0]
+    values = solve_memory_budget(budget, self._initial_settings,
+      num_torrents, total_memory)
+
+    return self._convert_preset(values)
+
+
+  def _get_preset_cache(self):
+
+    if self._preset_cache is None:
+      self._preset_cache = self._build_preset_cache()
+
+    return self._preset_cache
+
+
+  def _get_full_preset(self, preset):
+
+    if preset == PRESET_MEMORY_BUDGET:
+      return self._get_memory_budget_preset()[0]
+
+    full = self._get_preset_cache()["full"]
+    if preset not in full:
+      raise ValueError("Unknown preset: %r" % preset)
+
+    return dict(full[preset])
+
+
+  def _generate_presets(self):
+
+    config = component.get("PreferencesManager").config
+    facts = get_hardware_facts(config["download_location"])
+
+    return {
+      PRESET_HARDWARE: get_hardware_preset(facts),
+    }
+
+
+  def _update_live_settings(self, settings):
+
+    changes = {}
+
+    for k, v in settings.iteritems():
+      if (k not in self._live_settings or
+          not values_equal(self._live_settings[k], v)):
+        changes[k] = v
+
+    if changes:
+      self._revision += 1
+      self._live_settings.update(changes)
+      for k in changes:
+        self._key_revisions[k] = self._revision
+
+      component.get("EventManager").emit(
+        LtConfigSettingsChangedEvent(self._revision, changes))
+
+    return changes
+
+
+  def _normalize_settings(self, settings):
+
+    self._schema.normalize(settings, self._initial_settings)
+
+
+  def _apply_settings(self, settings, kind="apply"):
+
+    # Applies are serialized so each one diffs against the previous result
+    return self._apply_lock.run(self._set_session_settings, self._session,
+      dict(settings), kind)
+
+
+  def _get_affected_services(self, keys):
+
+    services = []
 
     for service in NETWORK_SERVICES:
+      patterns = NETWORK_SERVICE_DEPENDENCIES.get(service, [])
+      for key in keys:
+        if any(fnmatch.fnmatchcase(key, p) for p in patterns):
+          services.append(service)
+          break
+
+    return services
+
+
+  def _start_network_services(self, services=NETWORK_SERVICES):
+    config = component.get("PreferencesManager").config
+
+    for service in services:
+      if config[service]:
+        method = getattr(self._session, "start_%s" % service, None)
+        if method:
+          method()
+
+
+  def _stop_network_services(self, services=NETWORK_SERVICES):
+    config = component.get("PreferencesManager").config
+
+    for service in services:
       if config[service]:
         method = getattr(self._session, "stop_%s" % service, None)
         if method:
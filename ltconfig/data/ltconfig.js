@@ -89,6 +89,8 @@ Deluge.plugins.ltconfig.ui.PreferencePage = Ext.extend(Ext.Panel, {
 
   title: Deluge.plugins.ltconfig.DISPLAY_NAME,
 
+  settingsRevision: null,
+
   layout: {
     type: 'vbox',
     align: 'stretch'
@@ -104,6 +106,12 @@ Deluge.plugins.ltconfig.ui.PreferencePage = Ext.extend(Ext.Panel, {
       boxLabel: _('Apply settings on startup')
     });
 
+    this.chkEarlyApply = this.add({
+      xtype: 'checkbox',
+      margins: '0 5 5 5',
+      boxLabel: _('Apply settings before torrents resume')
+    });
+
     var caption = _('libtorrent version') + ': ';
     this.lblVersion = this.add({
       xtype: 'label',
@@ -124,7 +132,9 @@ Deluge.plugins.ltconfig.ui.PreferencePage = Ext.extend(Ext.Panel, {
           [0, 'Pre-ltConfig Settings'],
           [1, 'Libtorrent Defaults'],
           [2, 'High Performance Seed'],
-          [3, 'Minimum Memory Usage']
+          [3, 'Minimum Memory Usage'],
+          [4, 'Local Hardware'],
+          [5, 'Memory Budget']
         ],
         value: 0,
         editable: false,
@@ -203,6 +213,7 @@ Deluge.plugins.ltconfig.ui.PreferencePage = Ext.extend(Ext.Panel, {
 
       store: new Ext.data.ArrayStore({
         autoDestroy: true,
+        idIndex: 1,
 
         fields: [
           {name: 'enabled'},
@@ -240,6 +251,19 @@ Deluge.plugins.ltconfig.ui.PreferencePage = Ext.extend(Ext.Panel, {
         },
 
         afteredit: function(e) {
+          var spec = this.schema ? this.schema[e.record.get('name')] : null;
+          var value = e.value;
+
+          if (spec && (spec['type'] == 'int' || spec['type'] == 'long')) {
+            value = parseInt(e.value, 10);
+          } else if (spec && spec['type'] == 'float') {
+            value = parseFloat(e.value);
+          }
+
+          if (value !== e.value) {
+            e.record.set(e.field, isNaN(value) ? e.originalValue : value);
+          }
+
           e.record.commit();
         }
       },
@@ -261,16 +285,43 @@ Deluge.plugins.ltconfig.ui.PreferencePage = Ext.extend(Ext.Panel, {
       }
     });
 
+    caption = _('Estimated memory') + ': ';
+    this.lblMemory = this.add({
+      xtype: 'label',
+      margins: '5 5 0 5',
+      caption: caption,
+      text: caption + '?'
+    });
+
     this.presetsContainer.getComponent(1).setHandler(this.loadPreset, this);
+    this.tblSettings.getStore().on('update', this.queueMemoryEstimate, this);
 
     deluge.preferences.on('show', this.loadPrefs, this);
     deluge.preferences.buttons[1].on('click', this.savePrefs, this);
     deluge.preferences.buttons[2].on('click', this.savePrefs, this);
 
+    deluge.client.on('connected', this.onClientConnected, this);
+    deluge.events.on('LtConfigSettingsChangedEvent', this.onSettingsChanged,
+      this);
+
     this.waitForClient(10);
   },
 
   onDestroy: function() {
+    deluge.client.un('connected', this.onClientConnected, this);
+    deluge.events.un('LtConfigSettingsChangedEvent', this.onSettingsChanged,
+      this);
+
+    if (this.estimateTimer) {
+      clearTimeout(this.estimateTimer);
+      this.estimateTimer = null;
+    }
+
+    if (this.clientTimer) {
+      clearTimeout(this.clientTimer);
+      this.clientTimer = null;
+    }
+
     deluge.preferences.un('show', this.loadPrefs, this);
     deluge.preferences.buttons[1].un('click', this.savePrefs, this);
     deluge.preferences.buttons[2].un('click', this.savePrefs, this);
@@ -279,6 +330,8 @@ Deluge.plugins.ltconfig.ui.PreferencePage = Ext.extend(Ext.Panel, {
   },
 
   waitForClient: function(triesLeft) {
+    this.clientTimer = null;
+
     if (triesLeft < 1) {
       this.tblSettings.setEmptyText(_('Unable to load settings'));
       return;
@@ -288,46 +341,56 @@ Deluge.plugins.ltconfig.ui.PreferencePage = Ext.extend(Ext.Panel, {
         !deluge.client.ltconfig) {
       var self = this;
       var t = deluge.login.isVisible() ? triesLeft : triesLeft-1;
-      setTimeout(function() { self.waitForClient.apply(self, [t]); }, 1000);
+      this.clientTimer = setTimeout(function() {
+        self.waitForClient.apply(self, [t]);
+      }, 1000);
     } else if (!this.isDestroyed) {
       this.loadBaseState();
     }
   },
 
-  loadBaseState: function() {
-    this._loadBaseState1();
+  onClientConnected: function() {
+    // Skip the rest of the wait as soon as the client has its methods
+    if (this.clientTimer) {
+      clearTimeout(this.clientTimer);
+      this.clientTimer = null;
+      this.waitForClient(10);
+    }
   },
 
-  _loadBaseState1: function() {
-    deluge.client.core.get_libtorrent_version({
-      success: function(version) {
+  loadBaseState: function() {
+    deluge.client.ltconfig.get_state({
+      success: function(state) {
+        var version = state['version'];
         var parts = version.split('.');
         if (Number(parts[0]) < 1 && Number(parts[1]) < 16) {
           this.presetsContainer.getComponent(0).getStore().removeAt(2);
           this.presetsContainer.getComponent(0).getStore().removeAt(1);
         }
         this.lblVersion.setText(this.lblVersion.caption + version);
-        this._loadBaseState2();
-      },
-      scope: this
-    });
-  },
 
-  _loadBaseState2: function() {
-    deluge.client.ltconfig.get_original_settings({
-      success: function(settings) {
-        this.tblSettings.baseSettings = settings;
+        var baseSettings = state['original_settings'];
+        var settings = state['settings'];
+
+        this.tblSettings.schema = state['schema'];
+        this.tblSettings.baseSettings = baseSettings;
+        this.settingsRevision = state['revision'];
 
         var data = [];
-        var keys = Ext.keys(settings).sort();
+        var keys = Ext.keys(baseSettings).sort();
 
         for (var i = 0; i < keys.length; i++) {
           var key = keys[i];
-          data.push([false, key, settings[key], settings[key]]);
+          var actual = key in settings ? settings[key] : baseSettings[key];
+          data.push([false, key, baseSettings[key], actual]);
         }
 
         this.tblSettings.loadData(data);
-        this.loadPrefs();
+
+        this.preferences = state['preferences'];
+        this.chkApplyOnStart.setValue(this.preferences['apply_on_start']);
+        this.chkEarlyApply.setValue(this.preferences['early_apply']);
+        this.loadSettings(this.preferences['settings']);
       },
       scope: this
     });
@@ -344,6 +407,7 @@ Deluge.plugins.ltconfig.ui.PreferencePage = Ext.extend(Ext.Panel, {
       success: function(prefs) {
         this.preferences = prefs;
         this.chkApplyOnStart.setValue(prefs['apply_on_start']);
+        this.chkEarlyApply.setValue(prefs['early_apply']);
         this.loadSettings(prefs['settings']);
         this._loadPrefs2();
       },
@@ -352,24 +416,41 @@ Deluge.plugins.ltconfig.ui.PreferencePage = Ext.extend(Ext.Panel, {
   },
 
   _loadPrefs2: function() {
-    deluge.client.ltconfig.get_settings({
-      success: function(settings) {
-        var store = this.tblSettings.getStore();
-
-        for (var i = 0; i < store.getCount(); i++) {
-          var record = store.getAt(i);
-          var name = record.get('name');
-
-          if (name in settings) {
-            record.set('actual', settings[name]);
-            record.commit();
-          }
-        }
+    deluge.client.ltconfig.get_settings_since(this.settingsRevision, {
+      success: function(result) {
+        this.updateActualValues(result['revision'], result['settings']);
       },
       scope: this
     });
   },
 
+  onSettingsChanged: function(revision, settings) {
+    if (this.tblSettings.baseSettings) {
+      this.updateActualValues(revision, settings);
+    }
+  },
+
+  updateActualValues: function(revision, settings) {
+    var store = this.tblSettings.getStore();
+
+    for (var name in settings) {
+      if (!settings.hasOwnProperty(name)) {
+        continue;
+      }
+
+      var record = store.getById(name);
+
+      if (record) {
+        record.set('actual', settings[name]);
+        record.commit();
+      }
+    }
+
+    if (this.settingsRevision === null || revision > this.settingsRevision) {
+      this.settingsRevision = revision;
+    }
+  },
+
   savePrefs: function() {
     var settings = {};
     var store = this.tblSettings.getStore();
@@ -387,10 +468,12 @@ Deluge.plugins.ltconfig.ui.PreferencePage = Ext.extend(Ext.Panel, {
 
     var prefs = {
       apply_on_start: this.chkApplyOnStart.getValue(),
+      early_apply: this.chkEarlyApply.getValue(),
       settings: settings
     };
 
     apply |= prefs['apply_on_start'] != this.preferences['apply_on_start'];
+    apply |= prefs['early_apply'] != this.preferences['early_apply'];
     apply |= !Deluge.plugins.ltconfig.util.dictEquals(prefs['settings'],
       this.preferences['settings']);
 
@@ -421,6 +504,62 @@ Deluge.plugins.ltconfig.ui.PreferencePage = Ext.extend(Ext.Panel, {
     store.commitChanges();
   },
 
+  getViewSettings: function() {
+    var settings = {};
+    var store = this.tblSettings.getStore();
+
+    for (var i = 0; i < store.getCount(); i++) {
+      var record = store.getAt(i);
+
+      if (record.get('enabled')) {
+        settings[record.get('name')] = record.get('setting');
+      }
+    }
+
+    return settings;
+  },
+
+  queueMemoryEstimate: function(store, record, operation) {
+    if (!this.tblSettings.baseSettings ||
+        operation != Ext.data.Record.COMMIT) {
+      return;
+    }
+
+    if (this.estimateTimer) {
+      clearTimeout(this.estimateTimer);
+    }
+
+    this.estimateTimer = setTimeout(function() {
+      this.estimateTimer = null;
+      deluge.client.ltconfig.estimate_memory(this.getViewSettings(), {
+        success: this.updateMemoryEstimate,
+        scope: this
+      });
+    }.createDelegate(this), 500);
+  },
+
+  updateMemoryEstimate: function(estimate) {
+    var components = [];
+
+    for (var name in estimate['components']) {
+      if (estimate['components'].hasOwnProperty(name) &&
+          estimate['components'][name]) {
+        components.push([name, estimate['components'][name]]);
+      }
+    }
+
+    components.sort(function(a, b) { return b[1] - a[1]; });
+
+    var details = [];
+    for (var i = 0; i < components.length && i < 3; i++) {
+      details.push(components[i][0].replace(/_/g, ' ') + ' ' +
+        fsize(components[i][1]));
+    }
+
+    this.lblMemory.setText(this.lblMemory.caption +
+      fsize(estimate['total']) + ' (' + details.join(', ') + ')');
+  },
+
   loadPreset: function() {
     var preset = this.presetsContainer.getComponent(0).getValue();
 
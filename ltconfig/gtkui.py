@@ -46,6 +46,7 @@ from twisted.internet import reactor
 
 
 from deluge.ui.client import client
+from deluge.common import fsize
 from deluge.plugins.pluginbase import GtkPluginBase
 import deluge.component as component
 
@@ -65,6 +66,41 @@ log = logging.getLogger(__name__)
 log.addHandler(LOG_HANDLER)
 
 
+SCHEMA_TYPES = {
+  "bool": bool,
+  "int": int,
+  "long": long,
+  "float": float,
+  "str": str,
+}
+
+# Seconds to wait after an edit before estimating memory use.
+MEMORY_ESTIMATE_DELAY = 0.5
+
+# Preset ids and names offered in the presets combo box.
+PRESETS = [
+  (0, "Pre-ltConfig Settings"),
+  (1, "Libtorrent Defaults"),
+  (2, "High Performance Seed"),
+  (3, "Minimum Memory Usage"),
+  (4, "Local Hardware"),
+  (5, "Memory Budget"),
+]
+
+# Presets that need libtorrent 0.16 or later.
+PRESETS_0_16 = [1, 2]
+
+
+def format_memory_estimate(estimate):
+
+  components = sorted(estimate["components"].iteritems(),
+    key=lambda x: x[1], reverse=True)
+  details = ", ".join("%s %s" % (name.replace("_", " "), fsize(size))
+    for name, size in components[:3] if size)
+
+  return _("Estimated memory: %s (%s)") % (fsize(estimate["total"]), details)
+
+
 
 class GtkUI(GtkPluginBase):
 
@@ -73,6 +109,7 @@ class GtkUI(GtkPluginBase):
 
     super(GtkUI, self).__init__(plugin_name)
     self._initialized = False
+    self._estimate_call = None
 
 
   def enable(self):
@@ -84,10 +121,11 @@ class GtkUI(GtkPluginBase):
     self._blk_prefs = self._ui.get_widget("blk_preferences")
     self._lbl_ver = self._ui.get_widget("lbl_version")
     self._chk_apply_on_start = self._ui.get_widget("chk_apply_on_start")
+    self._chk_early_apply = self._ui.get_widget("chk_early_apply")
     self._blk_view = self._ui.get_widget("blk_view")
+    self._lbl_memory = self._ui.get_widget("lbl_memory")
 
-    self._presets = self._ui.get_widget("presets")
-    self._presets.set_active(0)
+    self._presets = self._build_presets()
     self._load_preset = self._ui.get_widget("load_preset")
     self._load_preset.connect("clicked", self._do_load_preset)
 
@@ -100,14 +138,17 @@ class GtkUI(GtkPluginBase):
 
     self._blk_prefs.show_all()
 
-    client.core.get_libtorrent_version().addCallback(self._do_update_version)
-    client.ltconfig.get_original_settings().addCallback(self._do_complete_init)
+    client.ltconfig.get_state().addCallback(self._do_complete_init)
+
 
+  def _do_complete_init(self, state):
 
-  def _do_complete_init(self, settings):
+    self._do_update_version(state["version"])
 
-    self._initial_settings = settings
+    self._schema = state["schema"]
+    self._initial_settings = state["original_settings"]
     self._prefs = {}
+    self._revision = None
 
     self._row_map = {}
     self._build_model(self._initial_settings)
@@ -118,9 +159,13 @@ class GtkUI(GtkPluginBase):
     component.get("PluginManager").register_hook(
         "on_show_prefs", self._do_load_preferences)
 
+    client.register_event_handler("LtConfigSettingsChangedEvent",
+      self._on_settings_changed)
+
     self._initialized = True
 
-    self._do_load_preferences()
+    self._show_preferences(state["preferences"])
+    self._update_actual_values(state)
 
     log.debug("GtkUI enabled")
 
@@ -131,6 +176,12 @@ class GtkUI(GtkPluginBase):
 
     self._initialized = False
 
+    if self._estimate_call and self._estimate_call.active():
+      self._estimate_call.cancel()
+
+    client.deregister_event_handler("LtConfigSettingsChangedEvent",
+      self._on_settings_changed)
+
     component.get("Preferences").remove_page(DISPLAY_NAME)
     component.get("PluginManager").deregister_hook(
         "on_apply_prefs", self._do_save_preferences)
@@ -140,6 +191,25 @@ class GtkUI(GtkPluginBase):
     log.debug("GtkUI disabled")
 
 
+  def _build_presets(self):
+
+    # Rows hold the preset id since rows are removed for older versions
+    model = gtk.ListStore(str, int)
+    for preset, name in PRESETS:
+      model.append((name, preset))
+
+    combo = self._ui.get_widget("presets")
+    combo.set_model(model)
+
+    cell = gtk.CellRendererText()
+    combo.pack_start(cell, True)
+    combo.add_attribute(cell, "text", 0)
+
+    combo.set_active(0)
+
+    return combo
+
+
   def _build_view(self):
 
     model = gtk.ListStore(bool, str,
@@ -235,14 +305,17 @@ class GtkUI(GtkPluginBase):
   def _do_edited(self, cell, path, text, model, column):
 
     value = model[path][column]
-    val_type = type(value)
+    spec = self._schema.get(model[path][1], {})
+    val_type = SCHEMA_TYPES.get(spec.get("type"), type(value))
 
     model[path][column] = val_type(text)
+    self._queue_memory_estimate()
 
 
   def _do_toggled(self, cell, path, model, column):
 
     model[path][column] = not model[path][column]
+    self._queue_memory_estimate()
 
 
   def _do_enable_toggled(self, cell, path, model, column):
@@ -253,6 +326,7 @@ class GtkUI(GtkPluginBase):
       model[path][2] = self._initial_settings[name]
 
     model[path][column] = not model[path][column]
+    self._queue_memory_estimate()
 
 
   def _render_cell(self, col, cell, model, iter, cell_type):
@@ -289,8 +363,9 @@ class GtkUI(GtkPluginBase):
     parts = version.split('.')
     if int(parts[0]) < 1 and int(parts[1]) < 16:
       model = self._presets.get_model()
-      del model[2]
-      del model[1]
+      for row in list(model):
+        if row[1] in PRESETS_0_16:
+          model.remove(row.iter)
 
     self._lbl_ver.set_label(version)
 
@@ -299,10 +374,11 @@ class GtkUI(GtkPluginBase):
 
     log.debug("Loading preset...")
 
-    index = self._presets.get_active()
-    if index > -1:
-        log.debug("Option=%d", index)
-        client.ltconfig.get_preset(index).addCallback(self._load_settings)
+    row = self._presets.get_active_iter()
+    if row is not None:
+        preset = self._presets.get_model()[row][1]
+        log.debug("Option=%d", preset)
+        client.ltconfig.get_preset(preset).addCallback(self._load_settings)
     else:
         log.debug("No preset selected...")
 
@@ -323,10 +399,12 @@ class GtkUI(GtkPluginBase):
         settings[row[1]] = row[2]
         apply_ |= row[2] != row[3]
 
-    preferences = {
+    preferences = dict(self._prefs)
+    preferences.update({
       "settings": settings,
       "apply_on_start": self._chk_apply_on_start.get_active(),
-    }
+      "early_apply": self._chk_early_apply.get_active(),
+    })
 
     apply_ |= not dict_equals(preferences, self._prefs)
 
@@ -349,13 +427,20 @@ class GtkUI(GtkPluginBase):
 
   def _update_preferences(self, preferences):
 
+    self._show_preferences(preferences)
+
+    client.ltconfig.get_settings_since(self._revision).addCallback(
+      self._update_actual_values)
+
+
+  def _show_preferences(self, preferences):
+
     self._prefs = preferences
 
     self._chk_apply_on_start.set_active(preferences["apply_on_start"])
+    self._chk_early_apply.set_active(preferences["early_apply"])
     self._load_settings(preferences["settings"])
 
-    client.ltconfig.get_settings().addCallback(self._update_actual_values)
-
 
   def _load_settings(self, settings):
 
@@ -368,10 +453,66 @@ class GtkUI(GtkPluginBase):
 
       model.set(self._row_map[key], 0, False, 2, self._initial_settings[key])
 
+    self._queue_memory_estimate()
+
 
-  def _update_actual_values(self, settings):
+  def _get_view_settings(self):
+
+    settings = {}
+
+    for row in self._view.get_model():
+      if row[0]:
+        settings[row[1]] = row[2]
+
+    return settings
+
+
+  def _queue_memory_estimate(self):
+
+    if not self._initialized:
+      return
+
+    if self._estimate_call and self._estimate_call.active():
+      self._estimate_call.cancel()
+
+    self._estimate_call = reactor.callLater(MEMORY_ESTIMATE_DELAY,
+      self._do_estimate_memory)
+
+
+  def _do_estimate_memory(self):
+
+    self._estimate_call = None
+
+    client.ltconfig.estimate_memory(self._get_view_settings()).addCallback(
+      self._update_memory_estimate)
+
+
+  def _update_memory_estimate(self, estimate):
+
+    if self._initialized:
+      self._lbl_memory.set_label(format_memory_estimate(estimate))
+
+
+  def _on_settings_changed(self, revision, settings):
+
+    if not self._initialized:
+      return
+
+    log.debug("Settings changed at revision %d", revision)
+
+    self._update_actual_values({
+      "revision": revision,
+      "settings": settings,
+    })
+
+
+  def _update_actual_values(self, result):
 
     model = self._view.get_model()
+    settings = result["settings"]
 
     for key in settings:
-      model.set(self._row_map[key], 3, settings[key])
+      if key in self._row_map:
+        model.set(self._row_map[key], 3, settings[key])
+
+    self._revision = max(self._revision, result["revision"])
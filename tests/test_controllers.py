@@ -0,0 +1,360 @@
+#
+# test_controllers.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Controller behaviour against simulated stats samples."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), "ltconfig"))
+
+from common.controllers import (
+  CacheTuner, PeerController, CACHE_BLOCK_SIZE,
+)
+
+
+MIB = 1024 * 1024
+BLOCKS_PER_MB = MIB / CACHE_BLOCK_SIZE
+
+# Mostly disk reads: hit ratio 0.1
+MISSING = {"cache_hits": 10.0, "blocks_read": 90.0, "rss": 100 * MIB}
+# Mostly cache hits: hit ratio 0.99
+HITTING = {"cache_hits": 99.0, "blocks_read": 1.0, "rss": 100 * MIB}
+# Moderate hit ratio inside the hysteresis band: 0.8
+STEADY = {"cache_hits": 80.0, "blocks_read": 20.0, "rss": 100 * MIB}
+IDLE = {"cache_hits": 0.0, "blocks_read": 0.0, "blocks_written": 0.0}
+
+
+def run(controller, samples, current, pinned=()):
+
+  # Feeds samples like Core does, keeping current in step with changes
+  changes = []
+  for sample in samples:
+    change = controller.evaluate(sample, current, pinned)
+    current.update(change)
+    changes.append(change)
+
+  return changes
+
+
+class CacheTunerTestCase(unittest.TestCase):
+
+  def create(self, total_memory=256 * MIB, **options):
+
+    options.setdefault("enabled", True)
+    options.setdefault("patience", 2)
+    options.setdefault("min_cache_mb", 16)
+    options.setdefault("max_cache_mb", 64)
+
+    return CacheTuner(options, total_memory)
+
+
+  def test_disabled(self):
+
+    tuner = self.create(enabled=False)
+    current = {"cache_size": 1024}
+
+    self.assertEqual(run(tuner, [MISSING] * 5, current), [{}] * 5)
+    self.assertEqual(tuner.state, "disabled")
+
+
+  def test_grows_on_low_hit_ratio(self):
+
+    tuner = self.create()
+    current = {"cache_size": 1024}
+
+    changes = run(tuner, [MISSING] * 2, current)
+
+    self.assertEqual(changes, [{}, {"cache_size": 1280}])
+    self.assertEqual(tuner.state, "adjusted")
+    self.assertEqual(len(tuner.adjustments), 1)
+    self.assertEqual(tuner.adjustments[0]["old"], {"cache_size": 1024})
+    self.assertEqual(tuner.adjustments[0]["new"], {"cache_size": 1280})
+
+
+  def test_shrinks_on_high_hit_ratio(self):
+
+    tuner = self.create()
+    current = {"cache_size": 2048}
+
+    changes = run(tuner, [HITTING] * 2, current)
+
+    self.assertEqual(changes[-1], {"cache_size": 1536})
+
+
+  def test_shrinks_when_idle(self):
+
+    tuner = self.create()
+    current = {"cache_size": 2048}
+
+    changes = run(tuner, [IDLE] * 2, current)
+
+    self.assertEqual(changes[-1], {"cache_size": 1536})
+    self.assertEqual(tuner.adjustments[-1]["reason"], "idle")
+
+
+  def test_holds_inside_band(self):
+
+    tuner = self.create()
+    current = {"cache_size": 2048}
+
+    self.assertEqual(run(tuner, [STEADY] * 5, current), [{}] * 5)
+    self.assertEqual(tuner.state, "holding")
+
+
+  def test_patience_resets_on_direction_change(self):
+
+    tuner = self.create(patience=3)
+    current = {"cache_size": 2048}
+
+    changes = run(tuner, [MISSING, MISSING, HITTING, MISSING, MISSING],
+      current)
+    self.assertEqual(changes, [{}] * 5)
+    self.assertEqual(tuner.state, "pending")
+
+    self.assertEqual(run(tuner, [MISSING], current), [{"cache_size": 2560}])
+
+
+  def test_stays_within_bounds(self):
+
+    tuner = self.create(patience=1)
+    current = {"cache_size": 2048}
+
+    run(tuner, [MISSING] * 20, current)
+    self.assertEqual(current["cache_size"], 64 * BLOCKS_PER_MB)
+    self.assertEqual(tuner.state, "bounded")
+
+    run(tuner, [IDLE] * 20, current)
+    self.assertEqual(current["cache_size"], 16 * BLOCKS_PER_MB)
+    self.assertEqual(tuner.state, "bounded")
+
+
+  def test_unset_cache_size_starts_at_lower_bound(self):
+
+    tuner = self.create(patience=1)
+    current = {}
+
+    self.assertEqual(run(tuner, [MISSING], current),
+      [{"cache_size": 16 * BLOCKS_PER_MB * 5 / 4}])
+
+
+  def test_automatic_cache_size_grows_from_its_real_size(self):
+
+    # An eighth of 256 MiB is 32 MiB
+    tuner = self.create(patience=1)
+    current = {"cache_size": -1}
+
+    self.assertEqual(run(tuner, [MISSING], current),
+      [{"cache_size": 32 * BLOCKS_PER_MB * 5 / 4}])
+
+
+  def test_automatic_cache_size_above_bounds_holds_on_grow(self):
+
+    # An eighth of 1 GiB is above max_cache_mb; growing must not shrink
+    tuner = self.create(total_memory=1024 * MIB, patience=1)
+    current = {"cache_size": -1}
+
+    self.assertEqual(run(tuner, [MISSING] * 3, current), [{}] * 3)
+    self.assertEqual(tuner.state, "bounded")
+
+    self.assertEqual(run(tuner, [IDLE], current),
+      [{"cache_size": 64 * BLOCKS_PER_MB}])
+
+
+  def test_automatic_cache_size_holds_without_total_memory(self):
+
+    tuner = self.create(total_memory=0, patience=1)
+    current = {"cache_size": -1}
+
+    self.assertEqual(run(tuner, [MISSING, IDLE], current), [{}] * 2)
+
+
+  def test_pinned_key_is_left_alone(self):
+
+    tuner = self.create(patience=1)
+    current = {"cache_size": 2048}
+
+    changes = run(tuner, [MISSING] * 3, current, {"cache_size": 2048})
+
+    self.assertEqual(changes, [{}] * 3)
+    self.assertEqual(tuner.state, "pinned")
+
+
+  def test_rss_limit_shrinks_immediately(self):
+
+    tuner = self.create(patience=3, max_rss_mb=50)
+    current = {"cache_size": 2048}
+
+    # Low hit ratio would grow, but RSS is over the limit
+    changes = run(tuner, [MISSING], current)
+
+    self.assertEqual(changes, [{"cache_size": 1536}])
+    self.assertEqual(tuner.adjustments[-1]["reason"], "rss above limit")
+
+
+  def test_configure_resets_votes(self):
+
+    tuner = self.create(patience=2)
+    current = {"cache_size": 2048}
+
+    run(tuner, [MISSING], current)
+    tuner.configure({"max_cache_mb": 128})
+
+    self.assertEqual(run(tuner, [MISSING], current), [{}])
+    self.assertEqual(tuner.options["max_cache_mb"], 128)
+
+
+class PeerControllerTestCase(unittest.TestCase):
+
+  def create(self, **options):
+
+    options.setdefault("enabled", True)
+    options.setdefault("patience", 1)
+    options.setdefault("upload_goal", 1000.0)
+
+    return PeerController(options)
+
+
+  def sample(self, kib, cpu=0.1):
+
+    return {"payload_upload_rate": kib * 1024.0, "cpu": cpu}
+
+
+  def current(self):
+
+    return {
+      "connections_limit": 200,
+      "unchoke_slots_limit": 8,
+      "max_peerlist_size": 3000,
+    }
+
+
+  def test_grows_below_goal(self):
+
+    controller = self.create()
+    current = self.current()
+
+    changes = run(controller, [self.sample(500)], current)
+
+    self.assertEqual(changes, [{
+      "connections_limit": 240,
+      "unchoke_slots_limit": 10,
+      "max_peerlist_size": 3600,
+    }])
+
+
+  def test_shrinks_above_goal(self):
+
+    controller = self.create()
+    current = self.current()
+
+    changes = run(controller, [self.sample(2000)], current)
+
+    self.assertEqual(changes[0]["connections_limit"], 160)
+
+
+  def test_holds_near_goal(self):
+
+    controller = self.create()
+    current = self.current()
+
+    self.assertEqual(run(controller, [self.sample(1050)] * 3, current),
+      [{}] * 3)
+
+
+  def test_cpu_ceiling_shrinks(self):
+
+    controller = self.create(cpu_ceiling=0.5)
+    current = self.current()
+
+    changes = run(controller, [self.sample(500, cpu=0.9)], current)
+
+    self.assertEqual(changes[0]["connections_limit"], 160)
+    self.assertEqual(controller.adjustments[-1]["reason"], "cpu 0.90")
+
+
+  def test_near_cpu_ceiling_does_not_grow(self):
+
+    controller = self.create(cpu_ceiling=0.5)
+    current = self.current()
+
+    self.assertEqual(run(controller, [self.sample(500, cpu=0.48)], current),
+      [{}])
+
+
+  def test_unlimited_starts_at_upper_bound(self):
+
+    controller = self.create(max_connections=1000)
+    current = self.current()
+    current["connections_limit"] = -1
+
+    changes = run(controller, [self.sample(2000)], current)
+
+    self.assertEqual(changes[0]["connections_limit"], 800)
+
+
+  def test_pinned_keys_are_skipped(self):
+
+    controller = self.create()
+    current = self.current()
+
+    changes = run(controller, [self.sample(500)], current,
+      {"unchoke_slots_limit": 8})
+
+    self.assertNotIn("unchoke_slots_limit", changes[0])
+    self.assertIn("connections_limit", changes[0])
+
+
+  def test_all_keys_pinned(self):
+
+    controller = self.create()
+    current = self.current()
+
+    self.assertEqual(run(controller, [self.sample(500)], current, current),
+      [{}])
+    self.assertEqual(controller.state, "pinned")
+
+
+  def test_missing_rate_holds(self):
+
+    controller = self.create()
+
+    self.assertEqual(run(controller, [{"cpu": 0.1}], self.current()), [{}])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,182 @@
+#
+# test_core.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Core behaviour against a fake session."""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+try:
+  import fake_session
+
+  from twisted.internet import defer
+
+  import deluge.component
+  import deluge.configmanager
+
+  import ltconfig.core
+  import ltconfig.common.schema
+except ImportError:
+  fake_session = None
+
+
+@unittest.skipIf(fake_session is None, "Deluge is not available")
+class EnableTestCase(unittest.TestCase):
+
+  def setUp(self):
+
+    self.config_dir = tempfile.mkdtemp()
+    deluge.configmanager.set_config_dir(self.config_dir)
+
+    self.session = fake_session.DictSession()
+    self.defaults = self.session.get_settings()
+
+    components = fake_session.FakeComponents(self.session)
+    self._component_get = deluge.component.get
+    deluge.component.get = components.get
+
+    self._libtorrent = ltconfig.core.libtorrent
+    self._defer_to_thread = ltconfig.core.deferToThread
+    ltconfig.core.libtorrent = fake_session.FakeLibtorrent(
+      self.session.version)
+    # Run threaded work inline so each apply completes synchronously
+    ltconfig.core.deferToThread = defer.maybeDeferred
+    ltconfig.common.schema._SCHEMA_CACHE.clear()
+
+    self.core = None
+
+
+  def tearDown(self):
+
+    if self.core:
+      self.core.disable()
+
+    deluge.component.get = self._component_get
+    ltconfig.core.libtorrent = self._libtorrent
+    ltconfig.core.deferToThread = self._defer_to_thread
+
+    shutil.rmtree(self.config_dir, ignore_errors=True)
+
+
+  def save_config(self, **values):
+
+    # Enable picks up the same config object from the config manager
+    config = deluge.configmanager.ConfigManager(ltconfig.core.CONFIG_FILE,
+      ltconfig.core.CONFIG_DEFAULTS)
+    ltconfig.core.init_config(config, ltconfig.core.CONFIG_DEFAULTS,
+      ltconfig.core.CONFIG_VERSION, ltconfig.core.CONFIG_SPECS)
+
+    for key, value in values.iteritems():
+      config[key] = value
+
+
+  def enable(self):
+
+    self.core = ltconfig.core.Core(ltconfig.core.PLUGIN_NAME)
+    self.core.enable()
+
+
+  def flush_apply(self):
+
+    call = self.core._apply_call
+    if call and call.active():
+      call.cancel()
+      self.core._flush_apply()
+
+
+  def make_override(self, settings):
+
+    now = time.time()
+
+    return {
+      "id": 1,
+      "label": "",
+      "settings": settings,
+      "created": now,
+      "expires": now + 3600,
+    }
+
+
+  def test_overlay_without_apply_on_start_leaves_preferences(self):
+
+    self.save_config(apply_on_start=False,
+      settings={"cache_size": 4096},
+      overrides=[self.make_override({"connections_limit": 50})])
+
+    self.enable()
+    self.flush_apply()
+
+    settings = self.session.get_settings()
+    self.assertEqual(settings["connections_limit"], 50)
+    self.assertEqual(settings["cache_size"], self.defaults["cache_size"])
+
+
+  def test_apply_on_start_applies_preferences(self):
+
+    self.save_config(apply_on_start=True,
+      settings={"cache_size": 4096},
+      overrides=[self.make_override({"connections_limit": 50})])
+
+    self.enable()
+
+    settings = self.session.get_settings()
+    self.assertEqual(settings["connections_limit"], 50)
+    self.assertEqual(settings["cache_size"], 4096)
+
+
+  def test_set_preferences_applies_preferences(self):
+
+    self.save_config(apply_on_start=False,
+      settings={"cache_size": 4096})
+
+    self.enable()
+    self.core.set_preferences({
+      "apply_on_start": False,
+      "settings": {"cache_size": 2048},
+    })
+    self.flush_apply()
+
+    self.assertEqual(self.session.get_settings()["cache_size"], 2048)
+
+
+if __name__ == "__main__":
+  unittest.main()
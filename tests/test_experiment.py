@@ -0,0 +1,220 @@
+#
+# test_experiment.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Experiment slot order and confidence intervals."""
+
+import os
+import sys
+import math
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), "ltconfig"))
+
+from common.experiment import (
+  Experiment, validate_experiment, t_critical, summarize, compare,
+)
+
+
+ARMS = [
+  {"name": "a", "preset": 1},
+  {"name": "b", "settings": {"cache_size": 4096}},
+]
+
+
+def make_experiment(**options):
+
+  options.setdefault("arms", ARMS)
+  options.setdefault("rounds", 2)
+  options.setdefault("slot_duration", 100.0)
+  options.setdefault("warmup", 10.0)
+  options.setdefault("metrics", ["payload_upload_rate"])
+
+  return Experiment(options)
+
+
+class StatisticsTestCase(unittest.TestCase):
+
+  def test_t_critical(self):
+
+    self.assertEqual(t_critical(0), None)
+    self.assertEqual(t_critical(1), 12.706)
+    self.assertEqual(t_critical(30), 2.042)
+    self.assertEqual(t_critical(100), 1.96)
+
+
+  def test_summarize(self):
+
+    summary = summarize([1, 2, 3, 4, 5])
+
+    self.assertEqual(summary["n"], 5)
+    self.assertEqual(summary["mean"], 3.0)
+    self.assertEqual(summary["variance"], 2.5)
+
+    margin = 2.776 * math.sqrt(0.5)
+    self.assertAlmostEqual(summary["ci"][0], 3.0 - margin)
+    self.assertAlmostEqual(summary["ci"][1], 3.0 + margin)
+
+
+  def test_summarize_small_samples(self):
+
+    self.assertEqual(summarize([]),
+      {"n": 0, "mean": None, "variance": None, "ci": None})
+    self.assertEqual(summarize([4]),
+      {"n": 1, "mean": 4.0, "variance": None, "ci": None})
+
+
+  def test_compare_welch(self):
+
+    # Equal variances and sizes give 8 degrees of freedom
+    result = compare(summarize([1, 2, 3, 4, 5]), summarize([3, 4, 5, 6, 7]))
+
+    self.assertEqual(result["difference"], 2.0)
+    self.assertAlmostEqual(result["ci"][0], 2.0 - 2.306)
+    self.assertAlmostEqual(result["ci"][1], 2.0 + 2.306)
+
+
+  def test_compare_unequal_variances(self):
+
+    a = summarize([10, 10, 11, 9])
+    b = summarize([0, 20, 40, 60])
+    result = compare(a, b)
+
+    va = a["variance"] / 4
+    vb = b["variance"] / 4
+    df = (va + vb) ** 2 / (va ** 2 / 3 + vb ** 2 / 3)
+    margin = t_critical(int(df)) * math.sqrt(va + vb)
+
+    self.assertEqual(int(df), 3)
+    self.assertAlmostEqual(result["ci"][1] - result["difference"], margin)
+
+
+  def test_compare_without_variance(self):
+
+    self.assertEqual(compare(summarize([1]), summarize([1, 2])), None)
+    self.assertEqual(compare(summarize([1, 1]), summarize([3, 3])),
+      {"difference": 2.0, "ci": [2.0, 2.0]})
+
+
+class ValidateExperimentTestCase(unittest.TestCase):
+
+  def test_invalid(self):
+
+    for options in [
+      {"arms": ARMS[:1]},
+      {"arms": [ARMS[0], dict(ARMS[1], name="a")]},
+      {"arms": [ARMS[0], {"name": "b"}]},
+      {"arms": ARMS, "slot_duration": 10.0, "warmup": 10.0},
+      {"arms": ARMS, "rounds": 0},
+    ]:
+      self.assertRaises(ValueError, validate_experiment, options)
+
+
+class ExperimentTestCase(unittest.TestCase):
+
+  def test_order_alternates_each_round(self):
+
+    experiment = make_experiment(rounds=3)
+
+    self.assertEqual(experiment.order, [0, 1, 1, 0, 0, 1])
+
+
+  def test_runs_slots_in_order(self):
+
+    experiment = make_experiment()
+    self.assertEqual(experiment.current_arm, None)
+
+    experiment.start(1000.0)
+    self.assertEqual(experiment.get_sample_window(), 1010.0)
+
+    arms = []
+    for i in xrange(4):
+      arms.append(experiment.current_arm["name"])
+      experiment.end_slot({"payload_upload_rate": i}, 1100.0 + i * 100)
+
+    self.assertEqual(arms, ["a", "b", "b", "a"])
+    self.assertEqual(experiment.state, "finished")
+    self.assertEqual(experiment.finished, 1400.0)
+    self.assertEqual(experiment.current_arm, None)
+    self.assertEqual(experiment.slots[1]["start"], 1100.0)
+    self.assertEqual(experiment.slots[1]["end"], 1200.0)
+
+
+  def test_results(self):
+
+    experiment = make_experiment()
+    experiment.start(0.0)
+
+    for rate in [10, 20, 22, 12]:
+      experiment.end_slot({"payload_upload_rate": rate})
+
+    results = experiment.results()
+
+    self.assertEqual(results["baseline"], "a")
+    self.assertEqual(results["arms"]["a"]["payload_upload_rate"]["mean"], 11.0)
+    self.assertEqual(results["arms"]["b"]["payload_upload_rate"]["mean"], 21.0)
+    self.assertEqual(
+      results["comparisons"]["b"]["payload_upload_rate"]["difference"], 10.0)
+
+
+  def test_missing_metrics_are_skipped(self):
+
+    experiment = make_experiment()
+    experiment.start(0.0)
+
+    for rate in [10, None, None, 12]:
+      experiment.end_slot({"payload_upload_rate": rate})
+
+    results = experiment.results()
+
+    self.assertEqual(results["arms"]["b"]["payload_upload_rate"]["n"], 0)
+    self.assertEqual(
+      results["comparisons"]["b"]["payload_upload_rate"], None)
+
+
+  def test_stop(self):
+
+    experiment = make_experiment()
+    experiment.start(0.0)
+    experiment.stop(now=50.0)
+
+    status = experiment.status()
+    self.assertEqual(status["state"], "stopped")
+    self.assertEqual(status["current_arm"], None)
+    self.assertEqual(status["total_slots"], 4)
+
+
+if __name__ == "__main__":
+  unittest.main()
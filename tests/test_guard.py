@@ -0,0 +1,221 @@
+#
+# test_guard.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Guarded apply behaviour driven by a fake clock."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), "ltconfig"))
+
+try:
+  from twisted.internet import task, defer
+  from common.guard import ApplyGuard
+except ImportError:
+  task = None
+
+
+OPTIONS = {
+  "metric": "upload_rate",
+  "threshold": 0.25,
+  "baseline": 60,
+  "probation": 120,
+  "interval": 5,
+}
+
+
+@unittest.skipIf(task is None, "Twisted is not available")
+class ApplyGuardTestCase(unittest.TestCase):
+
+  def setUp(self):
+
+    self.clock = task.Clock()
+    self.rate = 1000.0
+    self.applies = []
+    self.reverts = []
+    self.apply_result = {"cache_size": 4096}
+
+    self.guard = ApplyGuard(OPTIONS, self.sample, self.apply, self.revert,
+      clock=self.clock)
+
+    self.results = []
+    self.failures = []
+    self.guard.applied.addCallbacks(self.results.append,
+      self.failures.append)
+
+
+  def sample(self):
+
+    if self.rate is None:
+      return {}
+
+    return {"upload_rate": self.rate}
+
+
+  def apply(self):
+
+    self.applies.append(self.clock.seconds())
+    return self.apply_result
+
+
+  def revert(self):
+
+    self.reverts.append(self.clock.seconds())
+
+
+  def advance(self, seconds):
+
+    self.clock.pump([OPTIONS["interval"]] * int(seconds / OPTIONS["interval"]))
+
+
+  def test_samples_baseline_before_applying(self):
+
+    self.guard.start()
+    self.assertEqual(self.guard.state, "baseline")
+
+    self.advance(55)
+    self.assertEqual(self.applies, [])
+    self.assertEqual(len(self.guard.baseline_samples), 12)
+
+    self.advance(5)
+    self.assertEqual(self.applies, [60])
+    self.assertEqual(self.guard.state, "probation")
+    self.assertEqual(self.results, [self.apply_result])
+
+
+  def test_accepts_when_metric_holds(self):
+
+    self.guard.start()
+    self.advance(60)
+
+    self.rate = 900.0
+    self.advance(120)
+
+    self.assertEqual(self.guard.state, "accepted")
+    self.assertEqual(self.reverts, [])
+    self.assertAlmostEqual(self.guard.result["baseline"], 1000.0)
+    self.assertFalse(self.guard.active)
+
+
+  def test_reverts_on_regression(self):
+
+    self.guard.start()
+    self.advance(60)
+
+    self.rate = 500.0
+    self.advance(120)
+
+    self.assertEqual(self.guard.state, "reverted")
+    self.assertEqual(self.reverts, [180])
+    self.assertTrue(self.guard.result["regression"] > OPTIONS["threshold"])
+
+
+  def test_stops_sampling_after_evaluation(self):
+
+    self.guard.start()
+    self.advance(180)
+
+    samples = len(self.guard.probation_samples)
+    self.advance(60)
+
+    self.assertEqual(len(self.guard.probation_samples), samples)
+    self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+  def test_missing_metric_is_ignored(self):
+
+    self.rate = None
+    self.guard.start()
+    self.advance(60)
+
+    self.assertEqual(self.guard.baseline_samples, [])
+
+    self.rate = 100.0
+    self.advance(120)
+
+    # Nothing to compare against, so the settings are kept
+    self.assertEqual(self.guard.state, "accepted")
+    self.assertEqual(self.reverts, [])
+
+
+  def test_cancel_during_baseline(self):
+
+    self.guard.start()
+    self.advance(30)
+    self.guard.cancel("superseded")
+
+    self.assertEqual(self.guard.state, "cancelled")
+    self.assertEqual(len(self.failures), 1)
+    self.failures[0].trap(defer.CancelledError)
+
+    self.advance(60)
+    self.assertEqual(self.applies, [])
+    self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+  def test_cancel_during_probation(self):
+
+    self.guard.start()
+    self.advance(90)
+    self.guard.cancel("superseded")
+
+    self.assertEqual(self.guard.state, "cancelled")
+    self.assertEqual(self.results, [self.apply_result])
+    self.assertEqual(self.failures, [])
+
+    self.rate = 0.0
+    self.advance(120)
+    self.assertEqual(self.reverts, [])
+
+
+  def test_apply_failure(self):
+
+    def fail():
+      raise ValueError("apply failed")
+
+    self.guard._apply_func = fail
+    self.guard.start()
+    self.advance(60)
+
+    self.assertEqual(self.guard.state, "failed")
+    self.assertEqual(len(self.failures), 1)
+    self.failures[0].trap(ValueError)
+    self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,163 @@
+#
+# test_history.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Snapshot history compaction and rebuild."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), "ltconfig"))
+
+from common.history import SnapshotStore
+
+
+STATES = [
+  {"cache_size": 1024},
+  {"cache_size": 2048, "connections_limit": 200},
+  {"connections_limit": 200},
+  {"connections_limit": 400, "upload_rate_limit": 0},
+]
+
+
+def record_all(store, states):
+
+  return [store.record(dict(s), "state %d" % i) for i, s in enumerate(states)]
+
+
+class SnapshotStoreTestCase(unittest.TestCase):
+
+  def test_first_record_is_kept_even_if_empty(self):
+
+    store = SnapshotStore(10)
+
+    self.assertEqual(store.record({}, "initial"), 1)
+    self.assertEqual(store.get(1), {})
+
+
+  def test_unchanged_settings_are_not_recorded(self):
+
+    store = SnapshotStore(10)
+    store.record({"cache_size": 1024})
+
+    self.assertEqual(store.record({"cache_size": 1024}), None)
+    self.assertEqual(len(store.list()), 1)
+
+
+  def test_snapshots_store_diffs(self):
+
+    store = SnapshotStore(10)
+    record_all(store, STATES)
+
+    snapshots = store.list()
+    self.assertEqual(snapshots[1]["set"],
+      {"cache_size": 2048, "connections_limit": 200})
+    self.assertEqual(snapshots[2]["set"], {})
+    self.assertEqual(snapshots[2]["unset"], ["cache_size"])
+
+
+  def test_get_rebuilds_each_snapshot(self):
+
+    store = SnapshotStore(10)
+    ids = record_all(store, STATES)
+
+    for snapshot_id, state in zip(ids, STATES):
+      self.assertEqual(store.get(snapshot_id), state)
+
+    self.assertEqual(store.get(99), None)
+
+
+  def test_compaction_folds_oldest_into_base(self):
+
+    store = SnapshotStore(2)
+    ids = record_all(store, STATES)
+
+    self.assertEqual([s["id"] for s in store.list()], ids[-2:])
+    self.assertEqual(store.get(ids[0]), None)
+    self.assertEqual(store.get(ids[1]), None)
+
+    # Removed keys are dropped from the base as well
+    self.assertEqual(store.export()["base"], STATES[1])
+    self.assertEqual(store.get(ids[2]), STATES[2])
+    self.assertEqual(store.get(ids[3]), STATES[3])
+
+
+  def test_data_is_updated_in_place(self):
+
+    data = {}
+    store = SnapshotStore(2, data)
+    record_all(store, STATES)
+
+    self.assertEqual(data, store.export())
+    self.assertEqual(data["next_id"], len(STATES) + 1)
+
+
+  def test_reload_continues_from_saved_data(self):
+
+    data = {}
+    record_all(SnapshotStore(10, data), STATES)
+
+    store = SnapshotStore(10, data)
+
+    self.assertEqual(store.record(dict(STATES[-1])), None)
+    self.assertEqual(store.record({}), len(STATES) + 1)
+    self.assertEqual(store.get(len(STATES)), STATES[-1])
+
+
+  def test_reload_with_smaller_size_compacts(self):
+
+    data = {}
+    ids = record_all(SnapshotStore(10, data), STATES)
+
+    store = SnapshotStore(1, data)
+
+    self.assertEqual([s["id"] for s in store.list()], ids[-1:])
+    self.assertEqual(store.get(ids[-1]), STATES[-1])
+
+
+  def test_export_is_a_copy(self):
+
+    store = SnapshotStore(10)
+    record_all(store, STATES)
+
+    exported = store.export()
+    exported["snapshots"][0]["set"]["cache_size"] = 0
+
+    self.assertEqual(store.get(1), STATES[0])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,119 @@
+#
+# test_memory.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Memory estimate and budget solver."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), "ltconfig"))
+
+from common.memory import (
+  MIB, BLOCK_SIZE, BUDGET_RANGES, estimate_memory, solve_memory_budget,
+)
+from common.presets import LIBTORRENT_DEFAULTS
+
+
+def estimate_solved(settings, num_torrents):
+
+  proposed = dict(LIBTORRENT_DEFAULTS)
+  proposed.update(settings)
+
+  return estimate_memory(proposed, num_torrents,
+    proposed["connections_limit"])["total"]
+
+
+class EstimateMemoryTestCase(unittest.TestCase):
+
+  def test_peers_capped_by_connections_limit(self):
+
+    estimate = estimate_memory({"connections_limit": 100}, 10, 500)
+
+    self.assertEqual(estimate["peers"], 100)
+    self.assertEqual(estimate["total"], sum(estimate["components"].values()))
+
+
+  def test_auto_cache_uses_physical_memory(self):
+
+    estimate = estimate_memory({"cache_size": -1}, 0, 0, 8 * 1024 * MIB)
+
+    self.assertEqual(estimate["components"]["disk_cache"], 1024 * MIB)
+
+
+  def test_cache_size_in_blocks(self):
+
+    estimate = estimate_memory({"cache_size": 1024}, 0, 0)
+
+    self.assertEqual(estimate["components"]["disk_cache"], 1024 * BLOCK_SIZE)
+
+
+class SolveMemoryBudgetTestCase(unittest.TestCase):
+
+  def test_fits_budget(self):
+
+    for budget in (256, 2048, 16384):
+      solved = solve_memory_budget(budget * MIB, LIBTORRENT_DEFAULTS, 500)
+      self.assertTrue(estimate_solved(solved, 500) <= budget * MIB)
+
+
+  def test_larger_budget_gives_larger_values(self):
+
+    small = solve_memory_budget(512 * MIB, LIBTORRENT_DEFAULTS, 500)
+    large = solve_memory_budget(4096 * MIB, LIBTORRENT_DEFAULTS, 500)
+
+    for key in BUDGET_RANGES:
+      self.assertTrue(large[key] > small[key], key)
+
+
+  def test_torrent_count_reduces_values(self):
+
+    few = solve_memory_budget(2048 * MIB, LIBTORRENT_DEFAULTS, 10)
+    many = solve_memory_budget(2048 * MIB, LIBTORRENT_DEFAULTS, 5000)
+
+    self.assertTrue(many["cache_size"] < few["cache_size"])
+
+
+  def test_tiny_budget_uses_minimums(self):
+
+    solved = solve_memory_budget(1 * MIB, LIBTORRENT_DEFAULTS, 500)
+
+    self.assertEqual(solved, dict((k, v[0]) for k, v in
+      BUDGET_RANGES.iteritems()))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,210 @@
+#
+# test_rules.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Rule validation, hysteresis, duration and cooldown."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), "ltconfig"))
+
+from common.rules import RulesEngine, validate_rule, validate_rules
+
+
+CONDITION = {"metric": "cpu", "op": ">", "value": 0.9, "clear": 0.7}
+
+
+def make_rule(**options):
+
+  rule = {
+    "name": "busy",
+    "conditions": [CONDITION],
+    "settings": {"connections_limit": 50},
+    "duration": 0.0,
+    "cooldown": 0.0,
+  }
+  rule.update(options)
+
+  return validate_rule(rule)
+
+
+def run(engine, samples, start=0.0, step=10.0):
+
+  # Evaluates one sample per step, returning the active rule names after each
+  active = []
+  for i, sample in enumerate(samples):
+    engine.evaluate(sample, start + i * step)
+    active.append([r["name"] for r in engine.get_active()])
+
+  return active
+
+
+class ValidateRuleTestCase(unittest.TestCase):
+
+  def test_defaults(self):
+
+    rule = make_rule()
+
+    self.assertEqual(rule["preset"], None)
+    self.assertEqual(rule["keys"], None)
+
+
+  def test_preset(self):
+
+    rule = make_rule(settings=None, preset=3, keys=["cache_*"])
+
+    self.assertEqual(rule["preset"], 3)
+
+
+  def test_unknown_preset(self):
+
+    self.assertRaises(ValueError, make_rule, settings=None, preset=99)
+
+
+  def test_invalid(self):
+
+    for options in [
+      {"name": ""},
+      {"conditions": []},
+      {"conditions": [dict(CONDITION, op="==")]},
+      {"conditions": [{"op": ">", "value": 1}]},
+      {"settings": None},
+    ]:
+      self.assertRaises(ValueError, make_rule, **options)
+
+
+  def test_unique_names(self):
+
+    rule = make_rule()
+
+    self.assertRaises(ValueError, validate_rules, {"rules": [rule, rule]})
+
+
+class RulesEngineTestCase(unittest.TestCase):
+
+  def test_activates_and_clears(self):
+
+    engine = RulesEngine([make_rule()])
+
+    active = run(engine, [{"cpu": 0.5}, {"cpu": 0.95}, {"cpu": 0.5}])
+
+    self.assertEqual(active, [[], ["busy"], []])
+    self.assertEqual([f["active"] for f in engine.firings], [True, False])
+    self.assertEqual(engine.firings[0]["sample"], {"cpu": 0.95})
+
+
+  def test_clear_value_hysteresis(self):
+
+    engine = RulesEngine([make_rule()])
+
+    # Active rules hold between the clear and activation values
+    active = run(engine, [{"cpu": 0.95}, {"cpu": 0.8}, {"cpu": 0.75},
+      {"cpu": 0.65}])
+
+    self.assertEqual(active, [["busy"], ["busy"], ["busy"], []])
+
+
+  def test_inactive_rule_uses_activation_value(self):
+
+    engine = RulesEngine([make_rule()])
+
+    self.assertEqual(run(engine, [{"cpu": 0.8}] * 3), [[]] * 3)
+
+
+  def test_duration(self):
+
+    engine = RulesEngine([make_rule(duration=25.0)])
+
+    active = run(engine, [{"cpu": 0.95}] * 4)
+
+    self.assertEqual(active, [[], [], [], ["busy"]])
+
+
+  def test_duration_restarts_when_interrupted(self):
+
+    engine = RulesEngine([make_rule(duration=10.0)])
+
+    active = run(engine, [{"cpu": 0.95}, {"cpu": 0.5}, {"cpu": 0.95},
+      {"cpu": 0.95}])
+
+    self.assertEqual(active, [[], [], [], ["busy"]])
+
+
+  def test_cooldown(self):
+
+    engine = RulesEngine([make_rule(cooldown=25.0)])
+
+    active = run(engine, [{"cpu": 0.95}, {"cpu": 0.5}, {"cpu": 0.5},
+      {"cpu": 0.5}])
+
+    self.assertEqual(active, [["busy"], ["busy"], ["busy"], []])
+
+
+  def test_missing_metric_leaves_rule(self):
+
+    engine = RulesEngine([make_rule()])
+
+    active = run(engine, [{"cpu": 0.95}, {}, {"rss": 0}])
+
+    self.assertEqual(active, [["busy"]] * 3)
+    self.assertEqual(engine.status()["rules"]["busy"]["conditions"], [None])
+
+
+  def test_all_conditions_must_hold(self):
+
+    conditions = [CONDITION,
+      {"metric": "rss", "op": ">=", "value": 100, "clear": 80}]
+    engine = RulesEngine([make_rule(conditions=conditions)])
+
+    active = run(engine, [{"cpu": 0.95, "rss": 50},
+      {"cpu": 0.95, "rss": 100}, {"cpu": 0.95, "rss": 70}])
+
+    self.assertEqual(active, [[], ["busy"], []])
+
+
+  def test_evaluate_reports_changes(self):
+
+    engine = RulesEngine([make_rule()])
+
+    self.assertFalse(engine.evaluate({"cpu": 0.5}, 0.0))
+    self.assertTrue(engine.evaluate({"cpu": 0.95}, 10.0))
+    self.assertFalse(engine.evaluate({"cpu": 0.95}, 20.0))
+    self.assertEqual(engine.evaluations, 3)
+
+
+if __name__ == "__main__":
+  unittest.main()
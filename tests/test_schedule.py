@@ -0,0 +1,170 @@
+#
+# test_schedule.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Weekly schedule validation and transitions."""
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), "ltconfig"))
+
+from common.schedule import WeeklySchedule, validate_schedule
+
+
+SLOTS = [
+  {"days": [0, 1, 2, 3, 4], "start": "08:00", "profile": "day"},
+  {"days": [4], "start": "22:00", "profile": "night"},
+]
+
+PROFILES = {
+  "day": {"preset": 3},
+  "night": {"settings": {"upload_rate_limit": 0}},
+}
+
+
+def local_time(day, hour, minute, second=0):
+
+  # 1 January 2024 is a Monday; January avoids DST changes
+  return time.mktime((2024, 1, 1 + day, hour, minute, second, 0, 0, -1))
+
+
+class ValidateScheduleTestCase(unittest.TestCase):
+
+  def test_defaults(self):
+
+    schedule = validate_schedule({})
+
+    self.assertFalse(schedule["enabled"])
+    self.assertEqual(schedule["profiles"], {})
+    self.assertEqual(schedule["slots"], [])
+
+
+  def test_valid(self):
+
+    schedule = validate_schedule({"profiles": PROFILES, "slots": SLOTS})
+
+    self.assertEqual(schedule["slots"], SLOTS)
+
+
+  def test_unknown_preset(self):
+
+    self.assertRaises(ValueError, validate_schedule,
+      {"profiles": {"x": {"preset": 99}}})
+
+
+  def test_profile_needs_preset_or_settings(self):
+
+    self.assertRaises(ValueError, validate_schedule,
+      {"profiles": {"x": {}}})
+
+
+  def test_unknown_profile(self):
+
+    self.assertRaises(ValueError, validate_schedule,
+      {"slots": [{"days": [0], "start": "08:00", "profile": "x"}]})
+
+
+  def test_invalid_slot(self):
+
+    for slot in [
+      {"days": [7], "start": "08:00"},
+      {"days": [0], "start": "24:00"},
+      {"days": [0], "start": "8"},
+      {"days": [0], "start": None},
+    ]:
+      self.assertRaises(ValueError, validate_schedule, {"slots": [slot]})
+
+
+class WeeklyScheduleTestCase(unittest.TestCase):
+
+  def setUp(self):
+
+    self.schedule = WeeklySchedule(SLOTS)
+
+
+  def test_empty(self):
+
+    schedule = WeeklySchedule([])
+
+    self.assertEqual(schedule.get_active(local_time(0, 12, 0)), None)
+    self.assertEqual(schedule.get_next_transition(local_time(0, 12, 0)),
+      None)
+
+
+  def test_active_slot(self):
+
+    self.assertEqual(self.schedule.get_active(local_time(0, 8, 0)), 0)
+    self.assertEqual(self.schedule.get_active(local_time(4, 21, 59)), 0)
+    self.assertEqual(self.schedule.get_active(local_time(4, 22, 0)), 1)
+
+
+  def test_active_slot_wraps_around_week(self):
+
+    # The Friday night slot runs over the weekend until Monday morning
+    self.assertEqual(self.schedule.get_active(local_time(5, 12, 0)), 1)
+    self.assertEqual(self.schedule.get_active(local_time(0, 0, 0)), 1)
+    self.assertEqual(self.schedule.get_active(local_time(0, 7, 59)), 1)
+
+
+  def test_next_transition(self):
+
+    self.assertEqual(self.schedule.get_next_transition(local_time(0, 8, 0)),
+      local_time(1, 8, 0))
+    self.assertEqual(self.schedule.get_next_transition(local_time(4, 12, 0)),
+      local_time(4, 22, 0))
+
+
+  def test_next_transition_wraps_around_week(self):
+
+    self.assertEqual(self.schedule.get_next_transition(local_time(5, 12, 0)),
+      local_time(7, 8, 0))
+    self.assertEqual(
+      self.schedule.get_next_transition(local_time(4, 22, 0)),
+      local_time(7, 8, 0))
+
+
+  def test_next_transition_aligned_to_minute(self):
+
+    t = local_time(0, 7, 59, 30) + 0.5
+
+    self.assertEqual(self.schedule.get_next_transition(t),
+      local_time(0, 8, 0))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,119 @@
+#
+# test_stats.py
+#
+# Copyright (C) 2017 Ratanak Lun <ratanakvlun@gmail.com>
+#
+# This module is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Linking this software with other modules is making a combined work
+# based on this software. Thus, the terms and conditions of the GNU
+# General Public License cover the whole combination.
+#
+# As a special exception, the copyright holders of this software give
+# you permission to link this software with independent modules to
+# produce a combined work, regardless of the license terms of these
+# independent modules, and to copy and distribute the resulting work
+# under terms of your choice, provided that you also meet, for each
+# linked module in the combined work, the terms and conditions of the
+# license of that module. An independent module is a module which is
+# not derived from or based on this software. If you modify this
+# software, you may extend this exception to your version of the
+# software, but you are not obligated to do so. If you do not wish to
+# do so, delete this exception statement from your version.
+#
+
+"""Ring buffer history and session stats decoding."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), "ltconfig"))
+
+from common.stats import (
+  RingBuffer, StatsHistory, SessionStatsDecoder,
+)
+
+
+RESOLUTIONS = [(1, 300), (60, 1440), (3600, 720)]
+
+
+class RingBufferTestCase(unittest.TestCase):
+
+  def test_wraps_oldest_first(self):
+
+    buf = RingBuffer(3)
+    for t in xrange(5):
+      buf.append(float(t), t * 10.0)
+
+    self.assertEqual(len(buf), 3)
+    self.assertEqual(buf.items(), [(2.0, 20.0), (3.0, 30.0), (4.0, 40.0)])
+    self.assertEqual(buf.items(start=3, end=3), [(3.0, 30.0)])
+
+
+class StatsHistoryTestCase(unittest.TestCase):
+
+  def fill(self, history, step, duration):
+
+    for t in xrange(0, duration, step):
+      history.add(float(t), {"x": float(t), "missing": None})
+
+
+  def test_downsamples_to_bucket_means(self):
+
+    history = StatsHistory([(1, 10), (10, 5)])
+    self.fill(history, 1, 40)
+
+    self.assertEqual(history.get(["x"], 1)["x"],
+      [(0.0, 4.5), (10.0, 14.5), (20.0, 24.5)])
+    self.assertNotIn("missing", history.metrics)
+
+
+  def test_level_follows_sample_interval(self):
+
+    history = StatsHistory(RESOLUTIONS)
+    self.fill(history, 5, 3000)
+    start = history.latest_time - 600
+
+    # Assuming 1 s samples, level 0 would only reach back 300 s
+    self.assertEqual(history.get_level(start), 1)
+
+    history.sample_interval = 5
+    self.assertEqual(history.get_level(start), 0)
+    self.assertEqual(history.get_level(history.latest_time - 1600), 1)
+    self.assertEqual(history.mean(["x"], start)["x"], 2695.0)
+
+
+class SessionStatsDecoderTestCase(unittest.TestCase):
+
+  def test_counters_become_rates(self):
+
+    decoder = SessionStatsDecoder([
+      ("net.sent_payload_bytes", 0),
+      ("peer.num_peers_connected", 1),
+      ("ses.unrelated", 2),
+    ])
+
+    self.assertEqual(decoder.decode_values(0.0, [1000, 5, 1]),
+      {"num_peers": 5})
+    self.assertEqual(decoder.decode_values(2.0, [3000, 6, 1]),
+      {"num_peers": 6, "payload_upload_rate": 1000.0})
+    self.assertEqual(decoder.decode_values(3.0,
+      {"net.sent_payload_bytes": 4000, "peer.num_peers_connected": 7}),
+      {"num_peers": 7, "payload_upload_rate": 1000.0})
+
+
+if __name__ == "__main__":
+  unittest.main()